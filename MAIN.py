@@ -1,19 +1,89 @@
+import io
 import os
+import sys
+import hashlib
 import torch
 import asyncio
-from transformers import AutoTokenizer, AutoModel
-from PIL import Image
-import torchvision.transforms as T
+import argparse
+import threading
+from contextlib import nullcontext
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from transformers import AutoTokenizer, AutoModel, AutoModelForCausalLM
+from PIL import Image, ImageOps
+from torchvision.transforms import v2
 from datetime import datetime
 
+# lmdeploy is optional; when present the AWQ-quantized model is served by turbomind
+try:
+    from lmdeploy import pipeline as lmdeploy_pipeline
+    from lmdeploy.messages import TurbomindEngineConfig, GenerationConfig
+except ImportError:
+    lmdeploy_pipeline = None
+    TurbomindEngineConfig = None
+    GenerationConfig = None
+
 # Global variables for model and tokenizer
 global_model = None
 global_tokenizer = None
+global_pipeline = None
+global_draft_model = None
 
 # Model configuration
 MODEL_PATH = "OpenGVLab/InternVL2_5-1B"
+MODEL_PATH_AWQ = "OpenGVLab/InternVL2_5-1B-AWQ"
+USE_AWQ = os.environ.get("DOC_PROCESSOR_USE_AWQ", "1") != "0"
+
+# Optional small draft model for speculative (assisted) decoding. It must share the
+# language model's tokenizer; InternVL2.5-1B's LLM is Qwen2.5-0.5B, so leave unset
+# unless a smaller Qwen2.5-tokenizer draft is available.
+DRAFT_MODEL_PATH = os.environ.get("DOC_PROCESSOR_DRAFT_MODEL")
+NUM_ASSISTANT_TOKENS = 5
 device = "cuda" if torch.cuda.is_available() else "cpu"
-dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+
+def _select_dtype():
+    """Use bf16 on Ampere+ GPUs, fp16 on older GPUs and fp32 on CPU"""
+    if not torch.cuda.is_available():
+        return torch.float32
+    if torch.cuda.get_device_capability()[0] >= 8:
+        return torch.bfloat16
+    return torch.float16
+
+dtype = _select_dtype()
+
+# Special tokens InternVL uses to splice image features into the prompt
+IMG_START_TOKEN = '<img>'
+IMG_END_TOKEN = '</img>'
+IMG_CONTEXT_TOKEN = '<IMG_CONTEXT>'
+
+# Longest extraction template is ~17 fields, well under this many tokens
+MAX_NEW_TOKENS = 384
+
+# Preprocessing transform and normalization constants, built once at import
+_TO_UINT8 = v2.Compose([v2.ToImage(), v2.ToDtype(torch.uint8, scale=False)])
+_MEAN = torch.tensor((0.485, 0.456, 0.406), device=device).view(3, 1, 1)
+_STD = torch.tensor((0.229, 0.224, 0.225), device=device).view(3, 1, 1)
+
+# Per-thread side CUDA streams used by preprocessing workers for host-to-device copies
+_copy_streams = threading.local()
+
+# The compiled language model is not safe to run from several threads at once
+_generate_lock = threading.Lock()
+
+# Output file buffering: flush after this many images instead of after every one
+OUTPUT_BUFFER_SIZE = 1 << 20
+OUTPUT_FLUSH_INTERVAL = 32
+
+# Duplicate-page cache: content digest of each page file -> extraction response
+EXTRACTION_CACHE_SIZE = 4096
+_extraction_cache = OrderedDict()
+_extraction_cache_lock = threading.Lock()
+
+# Supported image extensions
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+
+# Number of images sent through the model in a single batched generate call
+DEFAULT_BATCH_SIZE = 8
 
 # System instructions for different document types
 passport_instruction = (
@@ -129,20 +199,156 @@ system_instructions = {
     "invoice": invoice_instruction
 }
 
+# Full chat question per document type, built once at import
+_PROMPT_STR = {
+    doc_type: f"<image>\n{instruction}\n\n"
+    for doc_type, instruction in system_instructions.items()
+}
+
+# Tokenized prompt inputs per document type, filled in once the model is loaded
+_PROMPT_INPUTS = {}
+
 def fix_asyncio_event_loop():
     """Fix for asyncio event loop issues with Streamlit"""
+    # Only Streamlit needs this; everywhere else it is pure overhead
+    if "streamlit" not in sys.modules:
+        return
     try:
-        loop = asyncio.get_event_loop()
+        asyncio.get_running_loop()
     except RuntimeError:
-        # If there is no event loop in the current thread, create one
+        # If there is no event loop running in the current thread, create one
         asyncio.set_event_loop(asyncio.new_event_loop())
 
+def load_awq_pipeline():
+    """Load the AWQ-quantized model through lmdeploy turbomind, or return None if unavailable"""
+    global global_pipeline
+    
+    if global_pipeline is not None:
+        return global_pipeline
+    
+    if not USE_AWQ or lmdeploy_pipeline is None or device != "cuda":
+        return None
+    
+    try:
+        print("Loading AWQ model with lmdeploy turbomind...")
+        global_pipeline = lmdeploy_pipeline(
+            MODEL_PATH_AWQ,
+            backend_config=TurbomindEngineConfig(model_format='awq', session_len=2048)
+        )
+        print("AWQ model loaded successfully!")
+    except Exception as e:
+        print(f"Error loading AWQ model, falling back to {MODEL_PATH}: {str(e)}")
+        global_pipeline = None
+    
+    return global_pipeline
+
+def is_awq_pipeline(model):
+    """Check whether the model returned by load_model is the lmdeploy AWQ pipeline"""
+    return global_pipeline is not None and model is global_pipeline
+
+def build_pipeline_generation_config(max_new_tokens=MAX_NEW_TOKENS):
+    """Greedy decoding config for the lmdeploy AWQ pipeline, matching build_generation_config"""
+    return GenerationConfig(max_new_tokens=max_new_tokens, do_sample=False)
+
+def build_generation_config(tokenizer, max_new_tokens=MAX_NEW_TOKENS, batch_size=1):
+    """Greedy decoding config for structured field extraction"""
+    # eos_token_id is filled in from the chat template separator at generate time
+    generation_config = dict(
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        num_beams=1,
+        use_cache=True,
+        pad_token_id=tokenizer.eos_token_id
+    )
+
+    # Assisted decoding only supports a batch size of 1
+    if global_draft_model is not None and batch_size == 1:
+        generation_config['assistant_model'] = global_draft_model
+
+    return generation_config
+
+def load_draft_model(tokenizer, model):
+    """Load the optional draft model for assisted decoding, disabling it if it doesn't work"""
+    global global_draft_model
+
+    if not DRAFT_MODEL_PATH:
+        return
+
+    try:
+        print(f"Loading draft model {DRAFT_MODEL_PATH} for assisted decoding...")
+        global_draft_model = AutoModelForCausalLM.from_pretrained(
+            DRAFT_MODEL_PATH,
+            torch_dtype=dtype,
+            low_cpu_mem_usage=True
+        ).to(device).eval()
+        global_draft_model.generation_config.num_assistant_tokens = NUM_ASSISTANT_TOKENS
+
+        # Verify assisted generation works with the model's generate path
+        with torch.inference_mode():
+            model.chat(
+                tokenizer=tokenizer,
+                pixel_values=torch.zeros((1, 3, 448, 448), device=device, dtype=dtype),
+                question=_PROMPT_STR["passport"],
+                generation_config=build_generation_config(tokenizer, max_new_tokens=8),
+                history=None,
+                return_history=False
+            )
+    except Exception as e:
+        print(f"Assisted decoding disabled: {str(e)}")
+        global_draft_model = None
+
+def configure_torch_backends():
+    """Enable TF32 matmuls and cuDNN autotuning for inference"""
+    if device != "cuda":
+        return
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.backends.cudnn.benchmark = True
+    torch.set_float32_matmul_precision('high')
+
+def compile_language_model(tokenizer, model):
+    """Compile the language model forward with torch.compile, falling back to eager on failure"""
+    if device != "cuda" or not hasattr(torch, "compile"):
+        return
+
+    language_model = model.language_model
+    eager_forward = language_model.forward
+
+    try:
+        # Compile forward rather than the module so HF generate() picks it up.
+        # Dynamic shapes keep the growing decode length from triggering a recompile per step;
+        # the default mode avoids recording a separate CUDA graph for every decode length.
+        language_model.forward = torch.compile(
+            eager_forward,
+            fullgraph=False,
+            dynamic=True
+        )
+
+        # Warm up on a blank page so the first real request doesn't pay the compile cost
+        print("Compiling language model...")
+        with torch.inference_mode():
+            model.chat(
+                tokenizer=tokenizer,
+                pixel_values=torch.zeros((1, 3, 448, 448), device=device, dtype=dtype),
+                question=_PROMPT_STR["passport"],
+                generation_config=build_generation_config(tokenizer, max_new_tokens=8),
+                history=None,
+                return_history=False
+            )
+    except Exception as e:
+        print(f"torch.compile failed, using eager language model: {str(e)}")
+        language_model.forward = eager_forward
+
 def load_model():
     """Load model with error handling"""
     global global_model, global_tokenizer
     
     try:
         # If model is already loaded, return the global instances
+        if global_pipeline is not None:
+            print("Using already loaded AWQ pipeline")
+            return global_tokenizer, global_pipeline
+        
         if global_model is not None and global_tokenizer is not None:
             print("Using already loaded model and tokenizer")
             return global_tokenizer, global_model
@@ -150,10 +356,20 @@ def load_model():
         # Fix potential asyncio issues
         fix_asyncio_event_loop()
         
+        # Prefer the INT4 AWQ model; the tokenizer is only needed on the fallback path
+        pipe = load_awq_pipeline()
+        if pipe is not None:
+            return global_tokenizer, pipe
+        
         print("Loading model for the first time...")
+        configure_torch_backends()
         
-        # Initialize tokenizer with error handling
-        global_tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH, trust_remote_code=True, use_fast=False)
+        # Initialize tokenizer with error handling, preferring the Rust fast tokenizer
+        try:
+            global_tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH, trust_remote_code=True, use_fast=True)
+        except Exception as e:
+            print(f"Fast tokenizer unavailable, using slow tokenizer: {str(e)}")
+            global_tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH, trust_remote_code=True, use_fast=False)
         global_tokenizer.pad_token = global_tokenizer.eos_token
 
         # Load model with error handling
@@ -161,10 +377,19 @@ def load_model():
             MODEL_PATH,
             torch_dtype=dtype,
             low_cpu_mem_usage=True,
-            trust_remote_code=True,
-            do_sample=True
+            trust_remote_code=True
         ).to(device).eval()
-        
+
+        # Fuse the language model's per-token kernels with torch.compile
+        compile_language_model(global_tokenizer, global_model)
+
+        # Speculative decoding with a small draft model, if one is configured
+        load_draft_model(global_tokenizer, global_model)
+
+        # Tokenize every document type's prompt up front
+        for doc_type in system_instructions:
+            get_prompt_inputs(global_tokenizer, global_model, doc_type)
+
         print("Model loaded successfully!")
         return global_tokenizer, global_model
     except Exception as e:
@@ -172,84 +397,178 @@ def load_model():
         print(error_msg)
         raise RuntimeError(error_msg)
 
-def preprocess_image(image_path, input_size=448, min_size=14):
-    """Preprocess image with error handling"""
-    try:
-        image = Image.open(image_path)
+def load_rgb_image(image_path, draft_size=None):
+    """Open an image file (path or file object) as an RGB PIL image"""
+    image = Image.open(image_path)
 
-        # Convert only if not already RGB
-        if image.mode != "RGB":
-            image = image.convert("RGB")
+    # Let the JPEG decoder downscale while decoding, never below draft_size
+    if draft_size is not None:
+        image.draft("RGB", draft_size)
 
-        # Get current image dimensions
-        w, h = image.size
-        
-        # Ensure minimum dimensions while maintaining aspect ratio
-        if w < min_size or h < min_size:
-            scale = max(min_size/w, min_size/h)
-            new_w = max(min_size, int(w * scale))
-            new_h = max(min_size, int(h * scale))
-            image = image.resize((new_w, new_h), Image.Resampling.LANCZOS)
-        
-        # Create a square image by padding with white
-        max_dim = max(image.size)
-        square_size = max(max_dim, input_size)
-        
-        # Create a white background
-        new_image = Image.new('RGB', (square_size, square_size), (255, 255, 255))
-        
-        # Paste the original image in the center
-        paste_x = (square_size - w) // 2
-        paste_y = (square_size - h) // 2
-        new_image.paste(image, (paste_x, paste_y))
-        
-        # Now resize to input_size if necessary
-        if square_size > input_size:
-            new_image = new_image.resize((input_size, input_size), Image.Resampling.LANCZOS)
-        
-        # Convert to tensor and normalize
-        transform = T.Compose([
-            T.ToTensor(),
-            T.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225))
-        ])
-        
-        return transform(new_image).unsqueeze(0).to(device, dtype=dtype)
+    # Convert only if not already RGB
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
+
+def _get_copy_stream():
+    """Return this thread's side CUDA stream, or None when running on CPU"""
+    if device != "cuda":
+        return None
+    stream = getattr(_copy_streams, 'stream', None)
+    if stream is None:
+        stream = _copy_streams.stream = torch.cuda.Stream()
+    return stream
+
+def _normalize(pixels, mean, std, out_dtype):
+    """Cast a letterboxed uint8 CHW image and normalize it into a (1, 3, H, W) batch"""
+    x = pixels.unsqueeze(0).to(torch.float32)
+    return ((x / 255 - mean) / std).to(out_dtype)
+
+# On CUDA, let Inductor fuse the cast and normalize so the uint8 pixels are read once.
+# Resizing happens on the CPU, so the input is always 448x448 and compiles to one static kernel.
+if device == "cuda" and hasattr(torch, "compile"):
+    _fused_normalize = torch.compile(_normalize, dynamic=False)
+else:
+    _fused_normalize = None
+
+def normalize_pixels(pixels):
+    """Normalize letterboxed device pixels, falling back to eager if compilation fails"""
+    global _fused_normalize
+
+    if _fused_normalize is not None:
+        try:
+            return _fused_normalize(pixels, _MEAN, _STD, dtype)
+        except Exception as e:
+            print(f"Fused preprocessing unavailable, using eager ops: {str(e)}")
+            _fused_normalize = None
+
+    return _normalize(pixels, _MEAN, _STD, dtype)
+
+def preprocess_image(image_path, input_size=448):
+    """Preprocess image with error handling"""
+    try:
+        return preprocess_pil_image(load_rgb_image(image_path, draft_size=(input_size, input_size)), input_size)
     except Exception as e:
         error_msg = f"Error preprocessing image: {str(e)}"
         print(error_msg)
         raise RuntimeError(error_msg)
 
+def preprocess_pil_image(image, input_size=448, out=None):
+    """Turn an RGB PIL image into a normalized (1, 3, input_size, input_size) device tensor.
+
+    When out is given (a (3, input_size, input_size) device slot), the result is written
+    into it and a (1, ...) view of out is returned.
+    """
+    # Letterbox on the CPU with one resample: shrink the long side, then pad to a white square
+    image.thumbnail((input_size, input_size), Image.Resampling.BILINEAR)
+    image = ImageOps.pad(image, (input_size, input_size), method=Image.Resampling.BILINEAR, color=(255, 255, 255))
+
+    # Decode to a uint8 tensor
+    pixels = _TO_UINT8(image)
+
+    # Pinned host memory lets the copy run asynchronously on a side stream,
+    # overlapping with inference running on the default stream
+    stream = _get_copy_stream()
+    if stream is not None:
+        pixels = pixels.pin_memory()
+
+    with torch.cuda.stream(stream) if stream is not None else nullcontext():
+        # Push the raw pixels to the device once
+        pixels = pixels.to(device, non_blocking=True)
+
+        # Cast and normalize on the device (fused when compiled)
+        pixel_values = normalize_pixels(pixels)
+        del pixels
+
+        # Write straight into the caller's batch slot so the batch needs no stacking copy
+        if out is not None:
+            out.copy_(pixel_values[0])
+            pixel_values = out.unsqueeze(0)
+
+    if stream is not None:
+        # The result is consumed on the default stream by the inference thread
+        if out is None:
+            pixel_values.record_stream(torch.cuda.default_stream())
+        stream.synchronize()
+
+    return pixel_values
+
+def content_digest(data):
+    """Digest of a page file's bytes, used as the extraction cache key"""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def lookup_cached_extraction(document_type, digest):
+    """Return the cached response for a byte-identical page, or None"""
+    with _extraction_cache_lock:
+        key = (document_type, digest)
+        if key in _extraction_cache:
+            _extraction_cache.move_to_end(key)
+            return _extraction_cache[key]
+    return None
+
+def store_cached_extraction(document_type, digest, response):
+    """Remember a page's response, evicting the least recently used entries"""
+    with _extraction_cache_lock:
+        key = (document_type, digest)
+        _extraction_cache[key] = response
+        _extraction_cache.move_to_end(key)
+        while len(_extraction_cache) > EXTRACTION_CACHE_SIZE:
+            _extraction_cache.popitem(last=False)
+
+def load_document_image(image_path, document_type, for_pipeline=False, input_size=448, out=None):
+    """Load an image for extraction, skipping preprocessing for pages already seen.
+
+    Returns (digest, cached_response, model_input); model_input is None on a cache hit.
+    """
+    # Key the cache on the file bytes so a hit skips decoding as well
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    digest = content_digest(data)
+
+    cached_response = lookup_cached_extraction(document_type, digest)
+    if cached_response is not None:
+        return digest, cached_response, None
+
+    # Decode fully while the buffer is open, so neither the image nor we keep the file bytes
+    with io.BytesIO(data) as buffer:
+        image = load_rgb_image(buffer, draft_size=None if for_pipeline else (input_size, input_size))
+        image.load()
+    del data
+
+    # The AWQ pipeline takes PIL images, the HF model takes preprocessed tensors
+    if for_pipeline:
+        return digest, None, image
+    return digest, None, preprocess_pil_image(image, input_size, out)
+
 def process_document_image(image_path, document_type, tokenizer, model):
     """Process a single document image and return extracted text"""
     try:
-        # Fix potential asyncio issues
-        fix_asyncio_event_loop()
-        
-        # Preprocess the image
-        pixel_values = preprocess_image(image_path)
-        
         # Get appropriate system instruction
         system_instruction = system_instructions.get(document_type, passport_instruction)
+
+        # Load the image, or reuse the extraction of an identical page
+        use_pipeline = is_awq_pipeline(model)
+        digest, cached_response, model_input = load_document_image(image_path, document_type, use_pipeline)
+        if cached_response is not None:
+            return cached_response
+
+        if use_pipeline:
+            # The AWQ pipeline does its own image preprocessing and prompt templating
+            response = model((system_instruction, model_input), gen_config=build_pipeline_generation_config()).text
+        else:
+            # Reuse the prompt tokenized at load time
+            prompt_inputs = get_prompt_inputs(tokenizer, model, document_type)
+            
+            # Configure generation
+            generation_config = build_generation_config(tokenizer)
+            
+            # Get model response
+            with torch.inference_mode():
+                response = generate_from_prompt_inputs(
+                    tokenizer, model, model_input, prompt_inputs, generation_config
+                )[0]
         
-        # Create prompt
-        prompt = f"<image>\n{system_instruction}\n\n"
-        
-        # Configure generation
-        generation_config = dict(
-            max_new_tokens=512, 
-            pad_token_id=tokenizer.eos_token_id
-        )
-        
-        # Get model response
-        response = model.chat(
-            tokenizer=tokenizer,
-            pixel_values=pixel_values,
-            question=prompt,
-            generation_config=generation_config,
-            history=None,
-            return_history=False
-        )
-        
+        store_cached_extraction(document_type, digest, response)
         return response
         
     except Exception as e:
@@ -257,10 +576,176 @@ def process_document_image(image_path, document_type, tokenizer, model):
         print(error_message)
         return f"Error processing image: {str(e)}"
 
-def process_multiple_images(image_folder, document_type="passport", output_file=None):
-    # Supported image extensions
-    image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
-    
+def build_prompt_inputs(tokenizer, model, document_type):
+    """Tokenize the chat prompt for a document type, the same way model.chat() does"""
+    # Reuse the conversation template shipped with the model's remote code
+    get_conv_template = sys.modules[type(model).__module__].get_conv_template
+    template = get_conv_template(model.template)
+    template.system_message = model.system_message
+    template.append_message(template.roles[0], _PROMPT_STR[document_type])
+    template.append_message(template.roles[1], None)
+    query = template.get_prompt()
+
+    # Expand the image placeholder to a single tile of context tokens
+    image_tokens = IMG_START_TOKEN + IMG_CONTEXT_TOKEN * model.num_image_token + IMG_END_TOKEN
+    query = query.replace('<image>', image_tokens, 1)
+
+    model_inputs = tokenizer(query, return_tensors='pt')
+    separator = template.sep.strip()
+    return {
+        'input_ids': model_inputs['input_ids'].to(device),
+        'attention_mask': model_inputs['attention_mask'].to(device),
+        'eos_token_id': tokenizer.convert_tokens_to_ids(separator),
+        'img_context_token_id': tokenizer.convert_tokens_to_ids(IMG_CONTEXT_TOKEN),
+        'separator': separator
+    }
+
+def get_prompt_inputs(tokenizer, model, document_type):
+    """Return the cached tokenized prompt for a document type, building it on first use"""
+    if document_type not in system_instructions:
+        document_type = "passport"
+
+    prompt_inputs = _PROMPT_INPUTS.get(document_type)
+    if prompt_inputs is None:
+        prompt_inputs = _PROMPT_INPUTS[document_type] = build_prompt_inputs(tokenizer, model, document_type)
+    return prompt_inputs
+
+def generate_from_prompt_inputs(tokenizer, model, pixel_values, prompt_inputs, generation_config):
+    """Run one generate call for a batch of images, reusing pre-tokenized prompt inputs"""
+    batch_size = pixel_values.shape[0]
+    model.img_context_token_id = prompt_inputs['img_context_token_id']
+
+    # Every image shares the same prompt, so expand instead of re-tokenizing.
+    # Callers may run on a thread pool, so only one generate runs at a time.
+    with _generate_lock:
+        generation_output = model.generate(
+            pixel_values=pixel_values,
+            input_ids=prompt_inputs['input_ids'].expand(batch_size, -1),
+            attention_mask=prompt_inputs['attention_mask'].expand(batch_size, -1),
+            **dict(generation_config, eos_token_id=prompt_inputs['eos_token_id'])
+        )
+
+    responses = tokenizer.batch_decode(generation_output, skip_special_tokens=True)
+    return [response.split(prompt_inputs['separator'])[0].strip() for response in responses]
+
+def _safe_load(image_path, document_type, for_pipeline, out=None):
+    """Load a document image, returning (loaded, error) instead of raising"""
+    try:
+        return load_document_image(image_path, document_type, for_pipeline, out=out), None
+    except Exception as e:
+        return None, str(e)
+
+def _buffer_slots(pixel_buffer, count):
+    """Per-image slots of a batch pixel buffer, or Nones when there is no buffer big enough"""
+    if pixel_buffer is None or count > pixel_buffer.shape[0]:
+        return [None] * count
+    return list(pixel_buffer[:count])
+
+def prefetch_document_batch(image_paths, document_type, model, executor, pixel_buffer=None):
+    """Start loading a batch of images in the executor, returning one future per image"""
+    for_pipeline = is_awq_pipeline(model)
+    slots = _buffer_slots(None if for_pipeline else pixel_buffer, len(image_paths))
+    return [
+        executor.submit(_safe_load, path, document_type, for_pipeline, slot)
+        for path, slot in zip(image_paths, slots)
+    ]
+
+def process_document_batch(image_paths, document_type, tokenizer, model, executor=None, prompt_inputs=None, prefetched=None, pixel_buffer=None):
+    """Process a batch of images in one generate call, returning (response, error) per image"""
+    results = [(None, None)] * len(image_paths)
+    use_pipeline = is_awq_pipeline(model)
+
+    # Load images in parallel so PIL decoding overlaps across files
+    if prefetched is None and executor is not None:
+        prefetched = prefetch_document_batch(image_paths, document_type, model, executor, pixel_buffer)
+
+    if prefetched is not None:
+        outcomes = [future.result() for future in prefetched]
+    else:
+        slots = _buffer_slots(None if use_pipeline else pixel_buffer, len(image_paths))
+        outcomes = [_safe_load(path, document_type, use_pipeline, slot) for path, slot in zip(image_paths, slots)]
+
+    # Keep track of which images still need the model
+    valid_indices = []
+    digests = []
+    inputs = []
+    for i, (loaded, error) in enumerate(outcomes):
+        if error is not None:
+            results[i] = (None, error)
+            continue
+
+        digest, cached_response, model_input = loaded
+        if cached_response is not None:
+            # Duplicate page: skip the vision encoder and LM entirely
+            results[i] = (cached_response, None)
+        else:
+            valid_indices.append(i)
+            digests.append(digest)
+            inputs.append(model_input)
+
+    if not inputs:
+        return results
+
+    try:
+        if use_pipeline:
+            # Get appropriate system instruction
+            system_instruction = system_instructions.get(document_type, passport_instruction)
+            responses = [
+                r.text for r in model(
+                    [(system_instruction, image) for image in inputs],
+                    gen_config=build_pipeline_generation_config()
+                )
+            ]
+        else:
+            # Images were preprocessed straight into the buffer; only stack when some
+            # slots were skipped (errors, cache hits) or there was no buffer
+            if pixel_buffer is not None and valid_indices == list(range(len(inputs))) and len(inputs) <= pixel_buffer.shape[0]:
+                pixel_values = pixel_buffer[:len(inputs)]
+            else:
+                pixel_values = torch.cat(inputs, dim=0)
+
+            if prompt_inputs is None:
+                prompt_inputs = get_prompt_inputs(tokenizer, model, document_type)
+
+            # Configure generation
+            generation_config = build_generation_config(tokenizer, batch_size=len(inputs))
+
+            # One generate call for the whole batch (each image is a single patch)
+            with torch.inference_mode():
+                responses = generate_from_prompt_inputs(
+                    tokenizer, model, pixel_values, prompt_inputs, generation_config
+                )
+
+        for i, digest, response in zip(valid_indices, digests, responses):
+            results[i] = (response, None)
+            store_cached_extraction(document_type, digest, response)
+    except Exception as e:
+        error_message = f"Error processing batch: {str(e)}"
+        print(error_message)
+        for i in valid_indices:
+            results[i] = (None, str(e))
+
+    return results
+
+def iter_images(image_folder, image_extensions=IMAGE_EXTENSIONS):
+    """Yield image file paths from a folder as the directory is scanned"""
+    with os.scandir(image_folder) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(image_extensions):
+                yield entry.path
+
+def iter_batches(items, batch_size):
+    """Group an iterable into lists of at most batch_size items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def process_multiple_images(image_folder, document_type="passport", output_file=None, batch_size=DEFAULT_BATCH_SIZE):
     # Set default output file if not provided
     if output_file is None:
         output_file = f"{document_type}_extractions.txt"
@@ -275,48 +760,84 @@ def process_multiple_images(image_folder, document_type="passport", output_file=
     tokenizer, model = load_model()
     print("Model loaded successfully!")
     
-    # Get all image files from the folder
-    image_files = [f for f in os.listdir(image_folder) if f.lower().endswith(image_extensions)]
+    # The document type is fixed for the whole folder, so tokenize the prompt once
+    prompt_inputs = None if is_awq_pipeline(model) else get_prompt_inputs(tokenizer, model, document_type)
+    
+    # Stream image paths from the folder in batches
+    batch_size = max(1, batch_size)
+    batches = iter_batches(iter_images(image_folder), batch_size)
     
-    # Process each image and write results to the output file
-    with open(output_file, 'w', encoding='utf-8') as out_file:
+    # Two persistent device buffers for batched pixel values: the next batch is
+    # preprocessed into one while the model reads the current batch from the other
+    if is_awq_pipeline(model):
+        pixel_buffers = (None, None)
+    else:
+        pixel_buffers = tuple(torch.empty((batch_size, 3, 448, 448), device=device, dtype=dtype) for _ in range(2))
+    
+    # Process images in batches and write results to the output file
+    with open(output_file, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as out_file, ThreadPoolExecutor() as executor:
         out_file.write(f"{document_type.capitalize()} Data Extraction - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
         
-        for i, filename in enumerate(image_files):
-            image_path = os.path.join(image_folder, filename)
-            print(f"Processing {i+1}/{len(image_files)}: {filename}")
+        batch_paths = next(batches, None)
+        next_prefetched = prefetch_document_batch(batch_paths, document_type, model, executor, pixel_buffers[0]) if batch_paths else None
+        processed = 0
+        unflushed = 0
+        batch_index = 0
+        
+        while batch_paths is not None:
+            print(f"Processing {processed + 1}-{processed + len(batch_paths)}")
             
-            try:
-                # Process the image
-                response = process_document_image(image_path, document_type, tokenizer, model)
-                
-                # Write to file
-                out_file.write(f"File: {filename}\n")
-                out_file.write(f"{response}\n")
-                out_file.write("-" * 50 + "\n\n")
-                
-                # Flush to ensure writing
-                out_file.flush()
-                
-            except Exception as e:
-                error_msg = f"Error processing {filename}: {str(e)}"
-                print(error_msg)
+            # Start loading the next batch while the model works on this one
+            prefetched = next_prefetched
+            pixel_buffer = pixel_buffers[batch_index % 2]
+            upcoming_paths = next(batches, None)
+            if upcoming_paths is not None:
+                next_prefetched = prefetch_document_batch(
+                    upcoming_paths, document_type, model, executor, pixel_buffers[(batch_index + 1) % 2]
+                )
+            
+            results = process_document_batch(
+                batch_paths, document_type, tokenizer, model, executor, prompt_inputs, prefetched, pixel_buffer
+            )
+            
+            # Write responses in the original file order
+            had_error = False
+            for image_path, (response, error) in zip(batch_paths, results):
+                filename = os.path.basename(image_path)
                 out_file.write(f"File: {filename}\n")
-                out_file.write(f"ERROR: {str(e)}\n")
+                if error is not None:
+                    had_error = True
+                    print(f"Error processing {filename}: {error}")
+                    out_file.write(f"ERROR: {error}\n")
+                else:
+                    out_file.write(f"{response}\n")
                 out_file.write("-" * 50 + "\n\n")
+            
+            # Let the buffered writer coalesce output, flushing periodically and on errors
+            processed += len(batch_paths)
+            unflushed += len(batch_paths)
+            if had_error or unflushed >= OUTPUT_FLUSH_INTERVAL:
                 out_file.flush()
+                unflushed = 0
+            
+            batch_paths = upcoming_paths
+            batch_index += 1
     
     print(f"Processing complete! Results saved to {output_file}")
 
 def main():
-    # Folder containing document images
-    image_folder = "Documents"
+    parser = argparse.ArgumentParser(description="Extract data from a folder of document images")
+    parser.add_argument("--image-folder", default="Documents", help="Folder containing document images")
+    parser.add_argument("--document-type", default="passport", choices=sorted(system_instructions), help="Type of documents in the folder")
+    parser.add_argument("--output-file", default="document_extraction_results.txt", help="Output file path")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Number of images per batched generate call")
+    args = parser.parse_args()
     
-    # Output file path
-    output_file = "document_extraction_results.txt"
+    # Fix potential asyncio issues once, up front
+    fix_asyncio_event_loop()
     
     # Process all images
-    process_multiple_images(image_folder, "passport", output_file)
+    process_multiple_images(args.image_folder, args.document_type, args.output_file, args.batch_size)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
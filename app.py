@@ -1,15 +1,25 @@
 import os
+import re
 import json
+import base64
+import hashlib
 import threading
-import queue
 import time
+import heapq
+import itertools
+import traceback
+import atexit
+from collections import defaultdict, OrderedDict
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, send_file
+from flask import Flask, Response, render_template, request, redirect, url_for, session, jsonify, flash, send_file
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.utils import secure_filename
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-from functools import wraps
+from functools import wraps, lru_cache
+from concurrent.futures import ThreadPoolExecutor, Future
 import pandas as pd
+from PIL import Image, features
 import MAIN as doc_processor
 from io import StringIO, BytesIO
 import csv
@@ -17,8 +27,34 @@ import shutil
 from gspread_pandas import Spread
 from user_auth import UserAuth
 
+# orjson is optional; when present it serializes API responses instead of the stdlib json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Initialize Flask app
 app = Flask(__name__)
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, falling back to Flask's default for unsupported types"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+if orjson is not None:
+    app.json = ORJSONProvider(app)
+
+def json_response(payload):
+    """Serialize payload straight to bytes for hot polling paths, skipping the str round trip"""
+    if orjson is None:
+        return jsonify(payload)
+    return Response(orjson.dumps(payload, default=app.json.default, option=orjson.OPT_NON_STR_KEYS),
+                    mimetype='application/json')
+
 app.secret_key = os.urandom(24)
 user_auth = UserAuth()  # Create UserAuth instance
 
@@ -28,16 +64,88 @@ app.config.update(
     ALLOWED_EXTENSIONS={'png', 'jpg', 'jpeg', 'pdf'},
     MAX_CONTENT_LENGTH=16 * 1024 * 1024,  # 16 MB limit
     CLEANUP_AFTER_PROCESSING=True,  # Enable automatic cleanup
-    CLEANUP_INTERVAL=3600  # Cleanup old files every hour (in seconds)
+    CLEANUP_INTERVAL=3600,  # Cleanup old files every hour (in seconds)
+    SAVED_FILE_RETENTION=3600,  # Keep saved documents on disk this long for the review page (in seconds)
+    RESULTS_CACHE_BYTES=512 * 1024 * 1024,  # Approximate payload budget for in-memory results
+    # When set (e.g. "/internal/uploads"), images are handed to nginx via X-Accel-Redirect
+    X_ACCEL_REDIRECT_PREFIX=os.environ.get("DOC_X_ACCEL_PREFIX")
 )
 
 # Create upload folder if it doesn't exist
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
 
+def entry_size(entry):
+    """Approximate bytes held by a results entry's text and binary payloads"""
+    size = 0
+    for value in entry.values():
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        elif isinstance(value, tuple):
+            size += sum(len(item) for item in value if isinstance(item, (str, bytes)))
+        elif isinstance(value, dict):
+            size += sum(len(str(k)) + len(str(v)) for k, v in value.items())
+    return size
+
+class LRUResults(OrderedDict):
+    """Results store capped at maxsize entries and roughly maxbytes of payload; storing
+    a key makes it most recent. Eviction takes saved entries first, then other settled
+    ones, least recent first; documents still processing are never evicted"""
+    def __init__(self, maxsize, maxbytes=None):
+        super().__init__()
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.lock = threading.RLock()
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            self.trim(keep=key)
+
+    def trim(self, keep=None):
+        """Evict entries until both caps hold again (or only pinned entries remain)"""
+        with self.lock:
+            total = sum(entry_size(entry) for entry in self.values()) if self.maxbytes else 0
+            for saved_only in (True, False):
+                for key in list(self):
+                    if len(self) <= self.maxsize and (not self.maxbytes or total <= self.maxbytes):
+                        return
+                    entry = self[key]
+                    if key == keep or entry.get('status') == 'processing':
+                        continue
+                    if saved_only and not entry.get('is_saved'):
+                        continue
+                    if self.maxbytes:
+                        total -= entry_size(entry)
+                    del self[key]
+
+    def purge_older_than(self, max_age):
+        """Drop entries created more than max_age seconds ago; returns the count"""
+        cutoff = time.time() - max_age
+        with self.lock:
+            expired = [key for key, value in self.items() if value.get('created', cutoff) < cutoff]
+            for key in expired:
+                del self[key]
+        return len(expired)
+
 # Global variables
-process_queue = queue.Queue()
-results_dict = {}
+# Documents are processed in parallel by a bounded pool of workers (DOC_WORKERS)
+processing_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("DOC_WORKERS", 4)),
+                                         thread_name_prefix='docproc')
+# Report/export generation runs on its own small pool, off the inference workers
+postproc_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='postproc')
+# Sheets bookkeeping (worksheet lookups, buffering rows) must not queue behind model batches
+sheets_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sheets')
+RESULTS_MAX = 512
+# Numbers every upload in this process, so two requests can't produce the same image ID
+# (next() on itertools.count is atomic under the GIL)
+_upload_sequence = itertools.count()
+RESULTS_TTL = 86400  # Same lifetime as the uploaded files
+results_dict = LRUResults(RESULTS_MAX, app.config['RESULTS_CACHE_BYTES'])
+results_lock = results_dict.lock  # Guards compound updates to results_dict from the workers
+_MODEL = None
+_model_lock = threading.Lock()
 
 ###################
 # UTILITY FUNCTIONS
@@ -55,158 +163,363 @@ def delete_file(file_path):
         print(f"Error deleting file {file_path}: {str(e)}")
         return False
 
+# Lowercased extension -> (canonical extension, mimetype)
+_EXT_TO_MIME = {
+    '.jpg': ('.jpg', 'image/jpeg'),
+    '.jpeg': ('.jpg', 'image/jpeg'),
+    '.png': ('.png', 'image/png'),
+    '.pdf': ('.pdf', 'application/pdf'),
+}
+
 def get_file_extension(path):
     """Extract file extension from path"""
-    if path.lower().endswith('.jpg') or path.lower().endswith('.jpeg'):
-        return '.jpg', 'image/jpeg'
-    elif path.lower().endswith('.png'):
-        return '.png', 'image/png'
-    elif path.lower().endswith('.pdf'):
-        return '.pdf', 'application/pdf'
-    else:
-        return '.png', 'image/png'  # Default
+    return _EXT_TO_MIME.get(os.path.splitext(path)[1].lower(), ('.png', 'image/png'))  # PNG by default
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+    return os.path.splitext(filename)[1][1:].lower() in app.config['ALLOWED_EXTENSIONS']
 
-def cleanup_uploads_folder():
-    """Removes files from the uploads folder that are older than 24 hours"""
-    while True:
-        try:
-            print("Starting scheduled cleanup of uploads folder...")
-            now = time.time()
-            count = 0
+THUMBNAIL_SIZE = (256, 256)
+# WebP thumbnails are several times smaller than JPEG at the same quality; fall back
+# to JPEG on Pillow builds without WebP support
+if features.check('webp'):
+    THUMBNAIL_FORMAT, THUMBNAIL_MIME, THUMBNAIL_OPTIONS = 'WEBP', 'image/webp', {'quality': 85, 'method': 4}
+else:
+    THUMBNAIL_FORMAT, THUMBNAIL_MIME, THUMBNAIL_OPTIONS = 'JPEG', 'image/jpeg', {'quality': 80}
+
+def get_thumbnail(image_id):
+    """Return a base64 data URI thumbnail for a document, cached on its results entry.
+    Returns None for files Pillow can't open (e.g. PDFs) or that are gone from disk"""
+    result = results_dict.get(image_id)
+    if result is None:
+        return None
+    if 'thumb_b64' in result:
+        return result['thumb_b64']
+    
+    thumb = None
+    try:
+        with Image.open(result['path']) as img:
+            img.draft('RGB', THUMBNAIL_SIZE)  # Let JPEGs decode at reduced scale
+            img = img.convert('RGB')
+            img.thumbnail(THUMBNAIL_SIZE)
+            buffer = BytesIO()
+            img.save(buffer, format=THUMBNAIL_FORMAT, **THUMBNAIL_OPTIONS)
+        thumb = f"data:{THUMBNAIL_MIME};base64," + base64.b64encode(buffer.getvalue()).decode('ascii')
+    except Exception as e:
+        print(f"Could not create thumbnail for {image_id}: {str(e)}")
+    
+    result['thumb_b64'] = thumb
+    return thumb
+
+FILE_MAX_AGE = 86400  # Uploads are removed after 24 hours
+
+# Upload paths already seen to be fresh, mapped to their mtime, so later passes can skip the stat
+KNOWN_FRESH_LIMIT = 4096
+_known_fresh = OrderedDict()
+
+# Min-heap of (expiry_time, path) for files saved by this process; the cleanup
+# thread sleeps until the earliest expiry or the next full sweep, whichever is first
+_cleanup_heap = []
+_cleanup_lock = threading.Lock()
+_cleanup_event = threading.Event()
+_cleanup_stop = threading.Event()
+
+def schedule_file_cleanup(file_path, delay=FILE_MAX_AGE):
+    """Register an uploaded file for deletion once it expires"""
+    with _cleanup_lock:
+        heapq.heappush(_cleanup_heap, (time.time() + delay, file_path))
+    _cleanup_event.set()
+
+def sweep_uploads_folder():
+    """Delete every file in the uploads folder older than FILE_MAX_AGE; returns the count"""
+    cutoff = time.time() - FILE_MAX_AGE
+    count = 0
+    
+    # DirEntry.is_file() uses the type from the directory listing, no extra stat
+    with os.scandir(app.config['UPLOAD_FOLDER']) as it:
+        for entry in it:
+            if not entry.is_file(follow_symlinks=False):
+                continue
             
-            # Get all files in the upload folder
-            for file_name in os.listdir(app.config['UPLOAD_FOLDER']):
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], file_name)
-                
-                # Check if it's a file (not a directory)
-                if os.path.isfile(file_path):
-                    # Check if file is older than 24 hours
-                    if now - os.path.getmtime(file_path) > 86400:  # 24 hours in seconds
-                        if delete_file(file_path):
-                            count += 1
+            # A file whose cached mtime is still inside the window can't be old yet
+            mtime = _known_fresh.get(entry.path)
+            if mtime is not None and mtime > cutoff:
+                continue
             
-            print(f"Cleanup complete. Deleted {count} old files.")
-        except Exception as e:
-            print(f"Error during scheduled cleanup: {str(e)}")
+            mtime = entry.stat(follow_symlinks=False).st_mtime
+            if mtime > cutoff:
+                _known_fresh[entry.path] = mtime
+                _known_fresh.move_to_end(entry.path)
+                if len(_known_fresh) > KNOWN_FRESH_LIMIT:
+                    _known_fresh.popitem(last=False)
+            else:
+                _known_fresh.pop(entry.path, None)
+                if delete_file(entry.path):
+                    count += 1
+    return count
+
+def cleanup_uploads_folder():
+    """Removes files from the uploads folder that are older than 24 hours"""
+    next_sweep = 0
+    while not _cleanup_stop.is_set():
+        _cleanup_event.clear()
+        now = time.time()
         
-        # Sleep for the configured interval
-        time.sleep(app.config['CLEANUP_INTERVAL'])
+        # Full sweep on the configured interval catches files from earlier runs
+        if now >= next_sweep:
+            try:
+                print("Starting scheduled cleanup of uploads folder...")
+                count = sweep_uploads_folder()
+                purged = results_dict.purge_older_than(RESULTS_TTL)
+                print(f"Cleanup complete. Deleted {count} old files and {purged} expired results.")
+            except Exception as e:
+                print(f"Error during scheduled cleanup: {str(e)}")
+            next_sweep = now + app.config['CLEANUP_INTERVAL']
+        
+        # Delete scheduled files that are due
+        with _cleanup_lock:
+            due = []
+            while _cleanup_heap and _cleanup_heap[0][0] <= now:
+                due.append(heapq.heappop(_cleanup_heap)[1])
+            next_expiry = _cleanup_heap[0][0] if _cleanup_heap else next_sweep
+        
+        for file_path in due:
+            _known_fresh.pop(file_path, None)
+            if os.path.exists(file_path):
+                delete_file(file_path)
+        
+        # Sleep until the next file is due; uploads and shutdown wake us early
+        _cleanup_event.wait(timeout=max(0, min(next_expiry, next_sweep) - now))
+
+def stop_cleanup_thread():
+    """Let the cleanup thread exit instead of sitting in its wait"""
+    _cleanup_stop.set()
+    _cleanup_event.set()
+
+# Matches "Key: Value" lines, trimming horizontal whitespace (including a trailing \r) around both
+_KV_RE = re.compile(r'^[^\S\n]*([^:\n]+?)[^\S\n]*:[^\S\n]*(.*?)[^\S\n]*$', re.M)
+
+@lru_cache(maxsize=512)
+def _parse_pairs(text):
+    """Key/value pairs of an extracted text, cached so re-uploaded content isn't re-parsed"""
+    return tuple(_KV_RE.findall(text))
 
 def parse_extracted_text(text, document_type):
     """Parse extracted text into structured data dictionary"""
-    data = {}
-    if text:
-        lines = text.strip().split('\n')
-        for line in lines:
-            if ':' in line:
-                key, value = line.split(':', 1)
-                data[key.strip()] = value.strip()
-    return data
+    # A fresh dict each call: callers update parsed data in place with corrections
+    return dict(_parse_pairs(text)) if text else {}
 
 # Start the cleanup thread
 cleanup_thread = threading.Thread(target=cleanup_uploads_folder, daemon=True)
 cleanup_thread.start()
+atexit.register(stop_cleanup_thread)
 
 #####################
 # GOOGLE SHEETS INTEGRATION
 #####################
 
+SPREADSHEET_NAME = "Document_Processing_App_Logs"
+
+# The authorized client and opened worksheets are reused across requests
+_sheets_client = None
+_worksheet_cache = {}
+_sheets_lock = threading.Lock()
+
 def setup_google_sheets():
-    """Initialize Google Sheets client"""
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    try:
-        creds = ServiceAccountCredentials.from_json_keyfile_name('google_credentials.json', scope)
-        client = gspread.authorize(creds)
-        return client
-    except Exception as e:
-        print(f"Error setting up Google Sheets: {str(e)}")
+    """Return the shared Google Sheets client, authorizing it on first use"""
+    global _sheets_client
+    with _sheets_lock:
+        if _sheets_client is not None:
+            return _sheets_client
+        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+        try:
+            creds = ServiceAccountCredentials.from_json_keyfile_name('google_credentials.json', scope)
+            _sheets_client = gspread.authorize(creds)
+            return _sheets_client
+        except Exception as e:
+            print(f"Error setting up Google Sheets: {str(e)}")
+            return None
+
+def _get_worksheet(spreadsheet_name, worksheet_name):
+    """Return a cached worksheet handle, opening it on a cache miss"""
+    key = (spreadsheet_name, worksheet_name)
+    with _sheets_lock:
+        sheet = _worksheet_cache.get(key)
+    if sheet is not None:
+        return sheet
+    
+    client = setup_google_sheets()
+    if not client:
         return None
+    sheet = client.open(spreadsheet_name).worksheet(worksheet_name)
+    with _sheets_lock:
+        _worksheet_cache[key] = sheet
+    return sheet
+
+def _invalidate_sheets_cache():
+    """Drop the cached client and worksheets so the next call re-authorizes (e.g. expired token)"""
+    global _sheets_client
+    with _sheets_lock:
+        _sheets_client = None
+        _worksheet_cache.clear()
+
+# Rows are buffered per worksheet and written with a single append_rows call by
+# the flusher thread, so saves and login logs never wait on the Sheets API. Each
+# row carries a Future that resolves True once written, or False if it is dropped
+SHEETS_FLUSH_ROWS = 50  # Flush as soon as this many rows are pending...
+SHEETS_FLUSH_INTERVAL = 2  # ...or once the oldest pending row is this old (seconds)
+SHEETS_RETRY_DELAY = 30  # Back off this long after a failed write (seconds)
+SHEETS_BUFFER_LIMIT = 1000  # Rows kept for retry while Sheets is unreachable
+SHEETS_TIMESTAMP_COLUMN = 1  # Every logged row is [email, timestamp, ...]
+_sheets_buffer = defaultdict(list)
+_sheets_pending = 0
+_sheets_flush_deadline = None  # When the pending rows are due; None while the buffer is empty
+_sheets_backoff_until = 0
+_sheets_buffer_lock = threading.Lock()
+_sheets_flush_event = threading.Event()
+
+def _flush_sheets_buffer():
+    """Write all buffered rows to their worksheets, one request per worksheet"""
+    global _sheets_pending, _sheets_flush_deadline, _sheets_backoff_until
+    with _sheets_buffer_lock:
+        pending = dict(_sheets_buffer)
+        _sheets_buffer.clear()
+        _sheets_pending = 0
+        _sheets_flush_deadline = None
+    
+    # Rows are buffered with an empty timestamp column; stamp them all once per flush
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for worksheet_name, entries in pending.items():
+        rows = [row for row, _ in entries]
+        for row in rows:
+            if row[SHEETS_TIMESTAMP_COLUMN] is None:
+                row[SHEETS_TIMESTAMP_COLUMN] = timestamp
+        try:
+            sheet = _get_worksheet(SPREADSHEET_NAME, worksheet_name)
+            if not sheet:
+                raise RuntimeError("Google Sheets client unavailable")
+            sheet.append_rows(rows, value_input_option="RAW")
+        except Exception as e:
+            print(f"Error writing {len(rows)} rows to {worksheet_name}: {str(e)}")
+            _invalidate_sheets_cache()
+            # Put the rows back in front of anything buffered since, so they are retried in order
+            with _sheets_buffer_lock:
+                buffered = entries + _sheets_buffer[worksheet_name]
+                if len(buffered) > SHEETS_BUFFER_LIMIT:
+                    print(f"Dropping {len(buffered) - SHEETS_BUFFER_LIMIT} oldest rows for {worksheet_name}")
+                    for _, written in buffered[:-SHEETS_BUFFER_LIMIT]:
+                        written.set_result(False)
+                    buffered = buffered[-SHEETS_BUFFER_LIMIT:]
+                _sheets_buffer[worksheet_name] = buffered
+                _sheets_pending = sum(len(queued) for queued in _sheets_buffer.values())
+                _sheets_backoff_until = time.time() + SHEETS_RETRY_DELAY
+                _sheets_flush_deadline = _sheets_backoff_until
+        else:
+            for _, written in entries:
+                written.set_result(True)
+
+def _buffer_sheet_row(worksheet_name, row):
+    """Queue a row for worksheet_name and wake the flusher when a flush becomes due.
+
+    Returns a Future that resolves True once the row is written, or False if it is dropped.
+    """
+    global _sheets_pending, _sheets_flush_deadline
+    written = Future()
+    with _sheets_buffer_lock:
+        _sheets_buffer[worksheet_name].append((row, written))
+        _sheets_pending += 1
+        if _sheets_flush_deadline is None:
+            _sheets_flush_deadline = time.time() + SHEETS_FLUSH_INTERVAL
+            _sheets_flush_event.set()
+        elif _sheets_pending >= SHEETS_FLUSH_ROWS and time.time() >= _sheets_backoff_until:
+            _sheets_flush_event.set()
+    return written
+
+def _sheets_flusher():
+    """Flush buffered rows when enough are pending or the oldest one is due"""
+    while True:
+        with _sheets_buffer_lock:
+            deadline = _sheets_flush_deadline
+            full = _sheets_pending >= SHEETS_FLUSH_ROWS and time.time() >= _sheets_backoff_until
+        
+        if deadline is not None and (full or time.time() >= deadline):
+            _flush_sheets_buffer()
+            continue
+        
+        _sheets_flush_event.wait(None if deadline is None else deadline - time.time())
+        _sheets_flush_event.clear()
+
+# Start the Sheets flusher thread and write any pending rows on shutdown
+sheets_flusher_thread = threading.Thread(target=_sheets_flusher, daemon=True)
+sheets_flusher_thread.start()
+atexit.register(_flush_sheets_buffer)
 
 def log_user_login(email):
     """Log user login information to Google Sheets"""
     try:
-        client = setup_google_sheets()
-        if client:
-            sheet = client.open("Document_Processing_App_Logs").worksheet("Login_Logs")
-            sheet.append_row([email, datetime.now().strftime("%Y-%m-%d %H:%M:%S")])
+        if _get_worksheet(SPREADSHEET_NAME, "Login_Logs"):
+            _buffer_sheet_row("Login_Logs", [email, None])
             return True
     except Exception as e:
         print(f"Error logging to Google Sheets: {str(e)}")
+        _invalidate_sheets_cache()
     return False
 
+# Sheet row layouts after the email/timestamp/document-type prefix. Check rows start
+# from a blank scaffold (Link to The file ... Market) and fill the extracted columns
+# by (index, key, fallback key)
+_CHECK_ROW_TEMPLATE = (" ",) * 27
+_CHECK_WRITE_FIELDS = (
+    (4, "Bank Name", "Bank Name"),
+    (5, "1st Payor First Name", "Payor Name"),
+    (9, "Payor Street Address", "Payor Address"),
+    (13, "Check Amount", "Amount"),
+    (17, "1st Payee First Name", "Payee Name"),
+    (21, "Check Number", "Check Number"),
+    (22, "Payee Street Address", "Payee Address"),
+)
+_PASSPORT_WRITE_KEYS = ("Passport Country Code", "Passport Number", "First Name",
+                        "Family Name", "Date of Birth", "Gender")
+_INVOICE_WRITE_KEYS = ("Invoice Number", "Invoice Date", "Vendor/Seller", "Total Amount")
+
 def save_document_data(email, document_type, data, corrections=None):
-    """Save processed document data to Google Sheets"""
+    """Save processed document data to Google Sheets; returns the buffered row's Future, or None"""
     try:
-        client = setup_google_sheets()
-        if client:
-            # Open the spreadsheet
-            sheet = client.open("Document_Processing_App_Logs").worksheet(f"{document_type.capitalize()}_Data")
+        worksheet_name = f"{document_type.capitalize()}_Data"
+        if _get_worksheet(SPREADSHEET_NAME, worksheet_name):
             
-            # Prepare row data
-            row_data = [email, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), document_type]
+            # Prepare row data; the timestamp is filled in when the row is flushed
+            row_data = [email, None, document_type]
             
             # Parse the extracted data based on document type
             if document_type == "check":
-                row_data.extend([
-                    " ",  # Link to The file
-                    " ",  # Pic Date
-                    " ",  # Download Date
-                    " ",  # Check Type
-                    data.get("Bank Name", ""),
-                    data.get("1st Payor First Name", data.get("Payor Name", "")),
-                    " ",  # 1st Payor Family Name
-                    " ",  # 2nd Payor First Name
-                    " ",  # 2nd Payor Family Name
-                    data.get("Payor Street Address", data.get("Payor Address", "")),
-                    " ",  # Payor City
-                    " ",  # Payor State
-                    " ",  # Payor Zip code
-                    data.get("Check Amount", data.get("Amount", "")),
-                    " ",  # Account Number
-                    " ",  # Routing Number
-                    " ",  # Payee Type
-                    data.get("1st Payee First Name", data.get("Payee Name", "")),
-                    " ",  # 1st Payee Family Name
-                    " ",  # 2nd Payee First Name
-                    " ",  # 2nd Payee Family Name
-                    data.get("Check Number", ""),
-                    data.get("Payee Street Address", data.get("Payee Address", "")),
-                    " ",  # Payee City
-                    " ",  # Payee State
-                    " ",  # Payee Zip Code
-                    " "   # Market
-                ])
+                check_row = list(_CHECK_ROW_TEMPLATE)
+                for index, key, fallback in _CHECK_WRITE_FIELDS:
+                    check_row[index] = data.get(key, data.get(fallback, ""))
+                row_data.extend(check_row)
             elif document_type == "passport":
-                row_data.extend([
-                    data.get("Passport Country Code", "Not found"),
-                    data.get("Passport Number", "Not found"),
-                    data.get("First Name", "Not found"),
-                    data.get("Family Name", "Not found"),
-                    data.get("Date of Birth", "Not found"),
-                    data.get("Gender", "Not found")
-                ])
+                row_data.extend([data.get(key, "Not found") for key in _PASSPORT_WRITE_KEYS])
             elif document_type == "invoice":
-                row_data.extend([
-                    data.get("Invoice Number", "Not found"),
-                    data.get("Invoice Date", "Not found"),
-                    data.get("Vendor/Seller", "Not found"),
-                    data.get("Total Amount", "Not found")
-                ])
+                row_data.extend([data.get(key, "Not found") for key in _INVOICE_WRITE_KEYS])
             
             # Add corrections info if available
             if corrections:
-                row_data.append(json.dumps(corrections))
+                row_data.append(json.dumps(corrections, separators=(',', ':')))
             
-            # Append data to sheet
-            sheet.append_row(row_data)
-            return True
+            # Buffer the row; it is written with the next batched append
+            return _buffer_sheet_row(worksheet_name, row_data)
     except Exception as e:
         print(f"Error saving to Google Sheets: {str(e)}")
-    return False
+        _invalidate_sheets_cache()
+    return None
+
+def log_user_login_async(email):
+    """Log a login on the Sheets executor so the response doesn't wait on Sheets"""
+    return sheets_executor.submit(log_user_login, email)
+
+def save_document_data_async(email, document_type, data, corrections=None):
+    """Save document data on the Sheets executor; returns the Future of save_document_data"""
+    return sheets_executor.submit(save_document_data, email, document_type, data, corrections)
 
 # Authentication decorator
 def login_required(f):
@@ -230,424 +543,330 @@ def login_required(f):
 # DOCUMENT PROCESSING
 #####################
 
-def background_processor():
-    """Background thread function to process documents from the queue"""
-    while True:
-        try:
-            # Get item from queue
-            task = process_queue.get()
-            if task is None:  # Sentinel to end the thread
-                break
+def get_model():
+    """Return the shared (tokenizer, model) pair, loading it once on first use"""
+    global _MODEL
+    if _MODEL is None:
+        # Double-checked so the first batch of workers doesn't race to load N copies
+        with _model_lock:
+            if _MODEL is None:
+                _MODEL = doc_processor.load_model()
+    return _MODEL
 
-            image_path, document_type, image_id, in_memory = task
-            temp_file_path = None
+def notify_status(image_id):
+    """Wake long-poll requests waiting on a document whose status has settled"""
+    result = results_dict.get(image_id)
+    if result is not None and 'event' in result:
+        result['event'].set()
 
-            try:
-                # Handle in-memory files (BytesIO objects)
-                if in_memory:
-                    # Get file extension and create temp file
-                    file_extension, _ = get_file_extension(results_dict[image_id]['path'])
-                    
-                    import tempfile
-                    temp_fd, temp_file_path = tempfile.mkstemp(suffix=file_extension)
-                    os.close(temp_fd)
-                    
-                    # Write BytesIO to temp file
-                    try:
-                        with open(temp_file_path, 'wb') as f:
-                            f.write(image_path.getvalue())
-                        image_path = temp_file_path
-                    except Exception as e:
-                        print(f"Error writing to temporary file: {str(e)}")
-                        results_dict[image_id]['status'] = 'error'
-                        results_dict[image_id]['error'] = f"Could not create temporary file: {str(e)}"
-                        process_queue.task_done()
-                        continue
+def record_extraction(image_id, image_path, document_type, extracted_data):
+    """Mark a document completed and hand it to the post-processing pool"""
+    # Update results with preserving existing data
+    with results_lock:
+        existing_data = results_dict[image_id].copy() if image_id in results_dict else {}
+        results_dict[image_id] = {
+            'status': 'completed',
+            'data': extracted_data,
+            'path': existing_data.get('path', image_path)
+        }
+        
+        # Preserve other metadata
+        for key, value in existing_data.items():
+            if key not in results_dict[image_id]:
+                results_dict[image_id][key] = value
+
+    # Process document-specific content on the post-processing pool
+    postproc_executor.submit(postprocess_document, image_id, document_type, extracted_data)
+
+def record_error(image_id, image_path, error):
+    """Mark a document failed and wake anyone waiting on it"""
+    with results_lock:
+        # Keep the upload metadata (name, path, event, ...) alongside the error
+        existing_data = results_dict.get(image_id, {})
+        results_dict[image_id] = dict(existing_data, status='error', error=error)
+        results_dict[image_id].setdefault('path', image_path)
+        results_dict[image_id].setdefault('name', os.path.basename(image_path))
+        results_dict[image_id].setdefault('basename', os.path.basename(image_path))
+        results_dict[image_id].setdefault('mimetype', get_file_extension(image_path)[1])
+        results_dict[image_id].setdefault('created', time.time())
+    notify_status(image_id)
+
+def process_upload_batch_task(jobs, document_type):
+    """Process the documents of one upload; runs on the processing executor.
+    jobs is a list of (image_path, image_id). Files go through the model in batches
+    of DEFAULT_BATCH_SIZE, one generate call each, and every document's results
+    entry is updated (and its waiters notified) as its batch finishes"""
+    pending = []
+    for image_path, image_id in jobs:
+        if os.path.exists(image_path):
+            pending.append((image_path, image_id))
+        else:
+            record_error(image_id, image_path, 'File not found')
+
+    try:
+        if not pending:
+            return
+        tokenizer, model = get_model()
+        # Prompt inputs are shared by every batch of this document type
+        prompt_inputs = None
+        if not doc_processor.is_awq_pipeline(model):
+            prompt_inputs = doc_processor.get_prompt_inputs(tokenizer, model, document_type)
+
+        while pending:
+            batch = pending[:doc_processor.DEFAULT_BATCH_SIZE]
+            outcomes = doc_processor.process_document_batch(
+                [image_path for image_path, _ in batch], document_type, tokenizer, model,
+                prompt_inputs=prompt_inputs
+            )
+            for (image_path, image_id), (extracted_data, error) in zip(batch, outcomes):
+                if error is not None:
+                    record_error(image_id, image_path, error)
                 else:
-                    # Check if file exists or needs to be created from memory
-                    if not os.path.exists(image_path):
-                        if 'image_data' in results_dict[image_id]:
-                            # Create temp file from image_data
-                            file_extension, _ = get_file_extension(image_path)
-                            
-                            import tempfile
-                            temp_fd, temp_file_path = tempfile.mkstemp(suffix=file_extension)
-                            os.close(temp_fd)
-                            
-                            try:
-                                with open(temp_file_path, 'wb') as f:
-                                    f.write(results_dict[image_id]['image_data'])
-                                image_path = temp_file_path
-                                in_memory = True
-                            except Exception as e:
-                                print(f"Error writing to temporary file from image data: {str(e)}")
-                                results_dict[image_id]['status'] = 'error'
-                                results_dict[image_id]['error'] = f"Could not create temporary file: {str(e)}"
-                                process_queue.task_done()
-                                continue
-                        else:
-                            results_dict[image_id]['status'] = 'error'
-                            results_dict[image_id]['error'] = 'File not found'
-                            process_queue.task_done()
-                            continue
-
-                # Process document with model
-                tokenizer, model = doc_processor.load_model()
-                extracted_data = doc_processor.process_document_image(
-                    image_path, document_type, tokenizer, model
-                )
-
-                # Update results with preserving existing data
-                existing_data = results_dict[image_id].copy() if image_id in results_dict else {}
-                results_dict[image_id] = {
-                    'status': 'completed',
-                    'data': extracted_data,
-                    'path': existing_data.get('path', image_path)
-                }
-                
-                # Preserve other metadata
-                for key, value in existing_data.items():
-                    if key not in results_dict[image_id]:
-                        results_dict[image_id][key] = value
-
-                # Process document-specific content
-                process_extracted_data_by_type(image_id, document_type, extracted_data)
-
-            finally:
-                # Clean up temporary file if created
-                if temp_file_path and os.path.exists(temp_file_path):
-                    delete_file(temp_file_path)
-                
-                # Clean up original file if needed and not in-memory
-                if not in_memory and app.config['CLEANUP_AFTER_PROCESSING'] and 'path' in results_dict[image_id]:
-                    original_path = results_dict[image_id]['path']
-                    if 'image_data' in results_dict[image_id] and os.path.exists(original_path):
-                        delete_file(original_path)
-
-                # Mark task as done
-                process_queue.task_done()
+                    record_extraction(image_id, image_path, document_type, extracted_data)
+            del pending[:len(batch)]
 
-        except Exception as e:
-            import traceback
-            traceback_str = traceback.format_exc()
-            print(f"Error in background processor: {str(e)}")
-            print(f"Traceback: {traceback_str}")
-            
-            if 'image_id' in locals():
-                results_dict[image_id] = {
-                    'status': 'error',
-                    'error': str(e),
-                    'path': image_path if 'image_path' in locals() else None
-                }
-                
-                # Preserve image_data if it exists
-                if image_id in results_dict and 'image_data' in results_dict[image_id]:
-                    results_dict[image_id]['image_data'] = results_dict[image_id]['image_data']
-                    
-            process_queue.task_done()
-            
-            # Clean up temporary file if created
-            if 'temp_file_path' in locals() and temp_file_path and os.path.exists(temp_file_path):
-                delete_file(temp_file_path)
+    except Exception as e:
+        traceback_str = traceback.format_exc()
+        print(f"Error in background processor: {str(e)}")
+        print(f"Traceback: {traceback_str}")
+        
+        # Fail whatever hadn't been recorded yet
+        for image_path, image_id in pending:
+            record_error(image_id, image_path, str(e))
+
+def postprocess_document(image_id, document_type, extracted_data):
+    """Build the text/CSV content for a processed document; runs on the post-processing executor"""
+    try:
+        process_extracted_data_by_type(image_id, document_type, extracted_data)
+        # The entry just grew by its report and export content
+        results_dict.trim(keep=image_id)
+    except Exception as e:
+        print(f"Error post-processing {image_id}: {str(e)}")
+        print(f"Traceback: {traceback.format_exc()}")
+        with results_lock:
+            result = results_dict.get(image_id)
+            if result is not None:
+                result['status'] = 'error'
+                result['error'] = str(e)
+    finally:
+        notify_status(image_id)
+
+# Plain-text report for check documents; filled with the filename followed by
+# one value per _CHECK_REPORT_LOOKUPS entry (model key, then report-field fallback)
+_CHECK_REPORT_TEMPLATE = (
+    "File: %s\n"
+    "Link to The file: \n"
+    "Pic Date: NA\n"
+    "Download Date: \n"
+    "Check Type: NA\n"
+    "Bank Name: %s\n"
+    "1st Payor First Name: %s\n"
+    "1st Payor Family Name: \n"
+    "2nd Payor First Name: \n"
+    "2nd Payor Family Name: \n"
+    "Payor Street Address: %s\n"
+    "Payor City: \n"
+    "Payor State: \n"
+    "Payor Zip code: \n"
+    "Check Amount: %s\n"
+    "Account Number: \n"
+    "Routing Number: \n"
+    "Payee Type: \n"
+    "1st Payee First Name: %s\n"
+    "1st Payee Family Name: \n"
+    "2nd Payee First Name: \n"
+    "2nd Payee Family Name: \n"
+    "Check Number: %s\n"
+    "Payee Street Address: %s\n"
+    "Payee City: \n"
+    "Payee State: \n"
+    "Payee Zip Code: \n"
+    "Market: \n"
+    + "-" * 50
+)
+_CHECK_REPORT_LOOKUPS = (
+    ('Bank Name', 'Bank Name'),
+    ('Payor Name', '1st Payor First Name'),
+    ('Payor Address', 'Payor Street Address'),
+    ('Amount', 'Check Amount'),
+    ('Payee Name', '1st Payee First Name'),
+    ('Check Number', 'Check Number'),
+    ('Payee Address', 'Payee Street Address'),
+)
+
+def _format_check_txt(image_id, extracted_data, extracted_data_dict):
+    """Formatted check report for the TXT download"""
+    values = tuple(extracted_data_dict.get(key, extracted_data_dict.get(fallback, 'NA'))
+                   for key, fallback in _CHECK_REPORT_LOOKUPS)
+    return _CHECK_REPORT_TEMPLATE % ((results_dict[image_id]['basename'],) + values)
+
+def _format_plain_txt(image_id, extracted_data, extracted_data_dict):
+    """Plain text documents are downloaded as extracted"""
+    return extracted_data
+
+# TXT formatter per document type, resolved once here instead of an if/elif chain per document;
+# passport, invoice and unknown types have no TXT report and get an empty string
+_TXT_FORMATTERS = {
+    'check': _format_check_txt,
+    'text': _format_plain_txt,
+}
 
 def process_extracted_data_by_type(image_id, document_type, extracted_data):
     """Process extracted data according to document type"""
-    # Initialize txt_content variable with a default value
-    txt_content = ""
-    
-    if document_type == 'check':
-        # Convert to dictionary if it's a string
-        extracted_data_dict = {}
-        if isinstance(extracted_data, str):
-            lines = extracted_data.strip().split('\n')
-            for line in lines:
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    extracted_data_dict[key.strip()] = value.strip()
-        elif isinstance(extracted_data, dict):
-            extracted_data_dict = extracted_data
-        else:
-            # If neither string nor dict, convert to string then parse
-            str_data = str(extracted_data)
-            lines = str_data.strip().split('\n')
-            for line in lines:
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    extracted_data_dict[key.strip()] = value.strip()
-
-        # Generate formatted text content
-        txt_content = "\n\n".join([
-            f"File: {os.path.basename(results_dict[image_id]['path'])}\n"
-            f"Link to The file: \n"
-            f"Pic Date: NA\n"
-            f"Download Date: \n"
-            f"Check Type: NA\n"
-            f"Bank Name: {extracted_data_dict.get('Bank Name', 'NA')}\n"
-            f"1st Payor First Name: {extracted_data_dict.get('Payor Name', extracted_data_dict.get('1st Payor First Name', 'NA'))}\n"
-            f"1st Payor Family Name: \n"
-            f"2nd Payor First Name: \n"
-            f"2nd Payor Family Name: \n"
-            f"Payor Street Address: {extracted_data_dict.get('Payor Address', extracted_data_dict.get('Payor Street Address', 'NA'))}\n"
-            f"Payor City: \n"
-            f"Payor State: \n"
-            f"Payor Zip code: \n"
-            f"Check Amount: {extracted_data_dict.get('Amount', extracted_data_dict.get('Check Amount', 'NA'))}\n"
-            f"Account Number: \n"
-            f"Routing Number: \n"
-            f"Payee Type: \n"
-            f"1st Payee First Name: {extracted_data_dict.get('Payee Name', extracted_data_dict.get('1st Payee First Name', 'NA'))}\n"
-            f"1st Payee Family Name: \n"
-            f"2nd Payee First Name: \n"
-            f"2nd Payee Family Name: \n"
-            f"Check Number: {extracted_data_dict.get('Check Number', 'NA')}\n"
-            f"Payee Street Address: {extracted_data_dict.get('Payee Address', extracted_data_dict.get('Payee Street Address', 'NA'))}\n"
-            f"Payee City: \n"
-            f"Payee State: \n"
-            f"Payee Zip Code: \n"
-            f"Market: \n"
-            f"{'-'*50}"
-        ])
-
-    elif document_type == 'passport':
-        # ... existing code ...
-        pass
-    elif document_type == 'invoice':
-        # ... existing code ...
-        pass
-    elif document_type == 'text':
-        txt_content = extracted_data  # This was likely missing in some code paths
+    # Convert to dictionary if it's a string (or anything else that isn't already a dict)
+    if isinstance(extracted_data, dict):
+        extracted_data_dict = extracted_data
     else:
-        # ... existing code ...
-        pass
+        extracted_data_dict = dict(_KV_RE.findall(str(extracted_data)))
+    
+    formatter = _TXT_FORMATTERS.get(document_type)
+    txt_content = formatter(image_id, extracted_data, extracted_data_dict) if formatter else ""
 
     results_dict[image_id]['txt_content'] = txt_content
+    # The CSV export is built from parsed_data on download (and cached there), so
+    # completed entries don't also carry a TSV copy of the same fields
     results_dict[image_id]['parsed_data'] = extracted_data_dict
 
-    # Generate CSV content
-    all_results = [{
-        'filename': os.path.basename(results_dict[image_id]['path']),
-        'extraction_data': extracted_data_dict
-    }]
-    csv_content = convert_to_csv_content(all_results, document_type)
-    results_dict[image_id]['csv_content'] = csv_content
-
-# Start background processing thread
-processor_thread = threading.Thread(target=background_processor, daemon=True)
-processor_thread.start()
-
 #####################
 # DATA EXPORT FUNCTIONS
 #####################
 
-def convert_to_csv_content(all_results, document_type=None):
-    """Convert text extraction results to TSV format with proper document type handling"""
-    output = StringIO()
-    writer = csv.writer(output, delimiter='\t')
-    
+# Per-document-type export layout: header row, then the data key feeding each
+# column after Filename (None for columns we don't extract) and the missing-value default
+_CHECK_HEADERS = [
+    'Filename',
+    'Link to The file',
+    'Pic Date',
+    'Download Date',
+    'Check Type',
+    'Bank Name',
+    '1st Payor First Name',
+    '1st Payor Family Name',
+    '2nd Payor First Name',
+    '2nd Payor Family Name',
+    'Payor Street Address',
+    'Payor City',
+    'Payor State',
+    'Payor Zip code',
+    'Check Amount',
+    'Account Number',
+    'Routing Number',
+    'Payee Type',
+    '1st Payee First Name',
+    '1st Payee Family Name',
+    '2nd Payee First Name',
+    '2nd Payee Family Name',
+    'Check Number',
+    'Payee Street Address',
+    'Payee City',
+    'Payee State',
+    'Payee Zip Code',
+    'Market'
+]
+_CHECK_FIELDS = [
+    None,  # Link to The file
+    None,  # Pic Date
+    None,  # Download Date
+    None,  # Check Type
+    'Bank Name',
+    'Payor Name',  # 1st Payor First Name
+    None,  # 1st Payor Family Name
+    None,  # 2nd Payor First Name
+    None,  # 2nd Payor Family Name
+    'Payor Address',
+    None,  # Payor City
+    None,  # Payor State
+    None,  # Payor Zip code
+    'Amount',
+    None,  # Account Number
+    None,  # Routing Number
+    None,  # Payee Type
+    'Payee Name',  # 1st Payee First Name
+    None,  # 1st Payee Family Name
+    None,  # 2nd Payee First Name
+    None,  # 2nd Payee Family Name
+    'Check Number',
+    'Payee Address',
+    None,  # Payee City
+    None,  # Payee State
+    None,  # Payee Zip Code
+    None   # Market
+]
+
+_PASSPORT_HEADERS = [
+    'Filename',
+    'Passport Country Code',
+    'Passport Type',
+    'Passport Number',
+    'First Name',
+    'Family Name',
+    'Date of Birth Day',
+    'Date of Birth Month',
+    'Date of Birth Year',
+    'Place of Birth',
+    'Gender',
+    'Date of Issue Day',
+    'Date of Issue Month',
+    'Date of Issue Year',
+    'Date of Expiration Day',
+    'Date of Expiration Month',
+    'Date of Expiration Year',
+    'Authority'
+]
+
+_INVOICE_HEADERS = [
+    'Filename',
+    'Invoice Number',
+    'Date',
+    'Due Date',
+    'Total Amount',
+    'Vendor Name',
+    'Customer Name',
+    'Payment Terms'
+]
+
+_EXPORT_LAYOUTS = {
+    'check': (_CHECK_HEADERS, _CHECK_FIELDS, 'Not found'),
+    'passport': (_PASSPORT_HEADERS, _PASSPORT_HEADERS[1:], 'NA'),
+    'invoice': (_INVOICE_HEADERS, _INVOICE_HEADERS[1:], 'NA'),
+}
+
+def content_key(document_type, data):
+    """Stable digest of a document's type and data, used to key cached export payloads"""
+    encoded = json.dumps([document_type, data], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).hexdigest()
+
+def _tsv_line(values):
+    """Join one row of cell values with tabs, flattening tabs and newlines inside cells"""
+    return '\t'.join(str(value).replace('\t', ' ').replace('\r', ' ').replace('\n', ' ') for value in values)
+
+def iter_tsv_lines(all_results, document_type=None):
+    """Yield the TSV export one newline-terminated line at a time, header first"""
     # Use passed document_type instead of reading from session
     doc_type = document_type or 'unknown'
+    layout = _EXPORT_LAYOUTS.get(doc_type)
     
-    # Define headers and data extraction based on document type
-    if doc_type == 'check':
-        headers = [
-            'Filename',
-            'Link to The file',
-            'Pic Date',
-            'Download Date',
-            'Check Type',
-            'Bank Name',
-            '1st Payor First Name',
-            '1st Payor Family Name',
-            '2nd Payor First Name',
-            '2nd Payor Family Name',
-            'Payor Street Address',
-            'Payor City',
-            'Payor State',
-            'Payor Zip code',
-            'Check Amount',
-            'Account Number',
-            'Routing Number',
-            'Payee Type',
-            '1st Payee First Name',
-            '1st Payee Family Name',
-            '2nd Payee First Name',
-            '2nd Payee Family Name',
-            'Check Number',
-            'Payee Street Address',
-            'Payee City',
-            'Payee State',
-            'Payee Zip Code',
-            'Market'
-        ]
-        
-        def extract_check_data(filename, extraction_text):
-            # Parse the raw extraction text to get check-specific data
-            data = {}
-            if isinstance(extraction_text, str):
-                lines = extraction_text.split('\n')
-                for line in lines:
-                    if ':' in line:
-                        key, value = [x.strip() for x in line.split(':', 1)]
-                        data[key] = value if value else 'NA'
-            else:
-                # If it's already a dictionary
-                data = extraction_text
-            
-            return [
-                filename,
-                'Not found',  # Link to The file
-                'Not found',  # Pic Date
-                'Not found',  # Download Date
-                'Not found',  # Check Type
-                data.get('Bank Name', 'Not found'),
-                data.get('Payor Name', 'Not found'),  # 1st Payor First Name
-                'Not found',  # 1st Payor Family Name
-                'Not found',  # 2nd Payor First Name
-                'Not found',  # 2nd Payor Family Name
-                data.get('Payor Address', 'Not found'),
-                'Not found',  # Payor City
-                'Not found',  # Payor State
-                'Not found',  # Payor Zip code
-                data.get('Amount', 'Not found'),
-                'Not found',  # Account Number
-                'Not found',  # Routing Number
-                'Not found',  # Payee Type
-                data.get('Payee Name', 'Not found'),  # 1st Payee First Name
-                'Not found',  # 1st Payee Family Name
-                'Not found',  # 2nd Payee First Name
-                'Not found',  # 2nd Payee Family Name
-                data.get('Check Number', 'Not found'),
-                data.get('Payee Address', 'Not found'),
-                'Not found',  # Payee City
-                'Not found',  # Payee State
-                'Not found',  # Payee Zip Code
-                'Not found'   # Market
-            ]
-        
-        # Write headers
-        writer.writerow(headers)
-        
-        # Process each result
+    if layout:
+        headers, fields, missing = layout
+        yield '\t'.join(headers) + '\n'
         for result in all_results:
-            filename = result['filename']
-            row = extract_check_data(filename, result['extraction_data'])
-            writer.writerow(row)
-            
-    elif doc_type == 'passport':
-        headers = [
-            'Filename',
-            'Passport Country Code',
-            'Passport Type',
-            'Passport Number',
-            'First Name',
-            'Family Name',
-            'Date of Birth Day',
-            'Date of Birth Month',
-            'Date of Birth Year',
-            'Place of Birth',
-            'Gender',
-            'Date of Issue Day',
-            'Date of Issue Month',
-            'Date of Issue Year',
-            'Date of Expiration Day',
-            'Date of Expiration Month',
-            'Date of Expiration Year',
-            'Authority'
-        ]
-        
-        def extract_passport_data(filename, data):
-            if isinstance(data, str):
-                # Parse the data string into a dictionary
-                data_dict = {}
-                lines = data.split('\n')
-                for line in lines:
-                    if ':' in line:
-                        key, value = line.split(':', 1)
-                        data_dict[key.strip()] = value.strip()
-                data = data_dict
-                
-            return [
-                filename,
-                data.get('Passport Country Code', 'NA'),
-                data.get('Passport Type', 'NA'),
-                data.get('Passport Number', 'NA'),
-                data.get('First Name', 'NA'),
-                data.get('Family Name', 'NA'),
-                data.get('Date of Birth Day', 'NA'),
-                data.get('Date of Birth Month', 'NA'),
-                data.get('Date of Birth Year', 'NA'),
-                data.get('Place of Birth', 'NA'),
-                data.get('Gender', 'NA'),
-                data.get('Date of Issue Day', 'NA'),
-                data.get('Date of Issue Month', 'NA'),
-                data.get('Date of Issue Year', 'NA'),
-                data.get('Date of Expiration Day', 'NA'),
-                data.get('Date of Expiration Month', 'NA'),
-                data.get('Date of Expiration Year', 'NA'),
-                data.get('Authority', 'NA')
-            ]
-        
-        # Write headers
-        writer.writerow(headers)
-        
-        # Process each result
-        for result in all_results:
-            filename = result['filename']
-            row = extract_passport_data(filename, result['extraction_data'])
-            writer.writerow(row)
-        
-    elif doc_type == 'invoice':
-        headers = [
-            'Filename',
-            'Invoice Number',
-            'Date',
-            'Due Date',
-            'Total Amount',
-            'Vendor Name',
-            'Customer Name',
-            'Payment Terms'
-        ]
-        
-        def extract_invoice_data(filename, data):
+            data = result['extraction_data']
             if isinstance(data, str):
-                # Parse the data string into a dictionary
-                data_dict = {}
-                lines = data.split('\n')
-                for line in lines:
-                    if ':' in line:
-                        key, value = line.split(':', 1)
-                        data_dict[key.strip()] = value.strip()
-                data = data_dict
-                
-            return [
-                filename,
-                data.get('Invoice Number', 'NA'),
-                data.get('Date', 'NA'),
-                data.get('Due Date', 'NA'),
-                data.get('Total Amount', 'NA'),
-                data.get('Vendor Name', 'NA'),
-                data.get('Customer Name', 'NA'),
-                data.get('Payment Terms', 'NA')
-            ]
-        
-        # Write headers
-        writer.writerow(headers)
-        
-        # Process each result
-        for result in all_results:
-            filename = result['filename']
-            row = extract_invoice_data(filename, result['extraction_data'])
-            writer.writerow(row)
-    
+                # Parse the raw extraction text; checks mark empty values as NA
+                if doc_type == 'check':
+                    data = {key: value or 'NA' for key, value in _KV_RE.findall(data)}
+                else:
+                    data = dict(_KV_RE.findall(data))
+            row = [result['filename']] + [data.get(key, missing) if key else missing for key in fields]
+            yield _tsv_line(row) + '\n'
     else:
-        headers = ['Filename', 'Extraction Data']
-        writer.writerow(headers)
-        
+        yield 'Filename\tExtraction Data\n'
         for result in all_results:
-            filename = result['filename']
-            writer.writerow([filename, str(result['extraction_data'])])
-    
-    return output.getvalue()
+            yield _tsv_line([result['filename'], result['extraction_data']]) + '\n'
+
+def convert_to_csv_content(all_results, document_type=None):
+    """Convert text extraction results to TSV format with proper document type handling"""
+    return ''.join(iter_tsv_lines(all_results, document_type))
 
 #####################
 # ROUTE HANDLERS
@@ -677,8 +896,8 @@ def process_login():
         session['user_role'] = result['role']
         session['user_id'] = result['id']
         
-        # Log to Google Sheets
-        log_user_login(email)
+        # Log to Google Sheets in the background
+        log_user_login_async(email)
         
         return redirect(url_for('document_selection'))
     else:
@@ -739,79 +958,113 @@ def upload_documents():
     if len(files) > 10:
         return jsonify({'error': 'You can only upload up to 10 files at a time'}), 400
 
-    processed_files = []
+    # One timestamp per batch; the process-wide sequence number keeps same-second uploads
+    # (from this request or any other) from colliding
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    
+    processed_ids = []
+    jobs = []
     for file in files:
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            unique_filename = f"{timestamp}_{filename}"
-            image_id = f"{timestamp}_{filename}"
+            unique_filename = f"{timestamp}_{next(_upload_sequence)}_{filename}"
+            image_id = unique_filename
             
-            file.seek(0, os.SEEK_END)
-            file_size = file.tell()
-            file.seek(0)
-            
-            file_data = file.read()
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
             
-            if file_size < 1024 * 1024 and app.config['CLEANUP_AFTER_PROCESSING']:
-                results_dict[image_id] = {
-                    'status': 'processing',
-                    'path': file_path,
-                    'image_data': file_data
-                }
-                file_buffer = BytesIO(file_data)
-                process_queue.put((file_buffer, document_type, image_id, True))
-            else:
-                with open(file_path, 'wb') as f:
-                    f.write(file_data)
+            # Stream the upload straight to disk; the worker reads it and the review page serves it from there
+            with open(file_path, 'wb') as f:
+                shutil.copyfileobj(file.stream, f, length=1024 * 1024)
+            schedule_file_cleanup(file_path)
 
+            with results_lock:
                 results_dict[image_id] = {
                     'status': 'processing', 
                     'path': file_path,
-                    'image_data': file_data
+                    'name': filename,
+                    # Stored once so the download and image routes don't recompute them per request
+                    'basename': unique_filename,
+                    'mimetype': get_file_extension(file_path)[1],
+                    'created': time.time(),
+                    'event': threading.Event()  # Set once the document settles; wakes long-polls
                 }
-                process_queue.put((file_path, document_type, image_id, False))
 
-            processed_files.append({
-                'id': image_id,
-                'name': filename,
-                'path': file_path
-            })
+            processed_ids.append(image_id)
+            jobs.append((file_path, image_id))
+
+    # One task for the whole upload so its files share batched generate calls
+    if jobs:
+        future = processing_executor.submit(process_upload_batch_task, jobs, document_type)
+        with results_lock:
+            for image_id in processed_ids:
+                if image_id in results_dict:
+                    results_dict[image_id]['future'] = future
 
+    # Only the IDs go into the (cookie) session; name and path live in results_dict
     session['document_type'] = document_type
-    session['processing_files'] = processed_files
+    session['processing_file_ids'] = processed_ids
 
     return jsonify({
         'success': True,
         'redirect': url_for('review_documents'),
-        'message': f'{len(processed_files)} files uploaded and being processed'
+        'message': f'{len(processed_ids)} files uploaded and being processed'
     })
 
 @app.route('/review')
 @login_required
 def review_documents():
     """Show document review page"""
-    if 'document_type' not in session or 'processing_files' not in session:
+    if 'document_type' not in session or 'processing_file_ids' not in session:
         flash('No documents selected for processing')
         return redirect(url_for('document_selection'))
-        
+    
+    # Rebuild the file list from results_dict, skipping entries that have expired.
+    # Thumbnails are inlined so the sidebar doesn't need one /document-image request
+    # per file; that route is still used for the full-resolution view
+    files = []
+    for image_id in session['processing_file_ids']:
+        result = results_dict.get(image_id)
+        if result is not None:
+            files.append({
+                'id': image_id,
+                'name': result['name'],
+                'path': result['path'],
+                'thumb': get_thumbnail(image_id)
+            })
+    
     return render_template(
         'review.html',
         document_type=session['document_type'],
-        files=session['processing_files']
+        files=files
     )
 
-@app.route('/api/check-status/<image_id>')
-@login_required
-def check_status(image_id):
-    """Check processing status of a document"""
+STATUS_WAIT_TIMEOUT = 25  # seconds a long-poll request blocks before answering
+
+def document_status(image_id):
+    """Build the status response shared by the polling and long-polling endpoints"""
     if image_id in results_dict:
         result = results_dict[image_id]
+        
+        # The upload's Future settles once the worker has recorded every entry of its batch;
+        # until then an entry may still have settled on its own
+        future = result.get('future')
+        if future is not None and future.done() and future.exception() is not None:
+            return jsonify({'status': 'error', 'error': str(future.exception())})
+        
+        if result['status'] == 'processing':
+            return jsonify({'status': 'processing'})
+        
+        # Completed documents are ready once post-processing has stored their content
+        if result['status'] == 'completed' and 'txt_content' not in result:
+            return jsonify({'status': 'processing'})
+        
         if result['status'] == 'completed':
-            # Parse the extracted text into structured data
-            extracted_data = parse_extracted_text(result['data'], session['document_type'])
-            return jsonify({
+            # Parsed once (post-processing normally does it); later polls reuse it
+            extracted_data = result.get('parsed_data')
+            if extracted_data is None:
+                extracted_data = parse_extracted_text(result['data'], session['document_type'])
+                result['parsed_data'] = extracted_data
+            return json_response({
                 'status': 'completed',
                 'data': extracted_data
             })
@@ -825,30 +1078,51 @@ def check_status(image_id):
     else:
         return jsonify({'status': 'not_found'})
 
+@app.route('/api/check-status/<image_id>')
+@login_required
+def check_status(image_id):
+    """Check processing status of a document"""
+    return document_status(image_id)
+
+@app.route('/api/wait-status/<image_id>')
+@login_required
+def wait_status(image_id):
+    """Long-poll status: block until the document finishes (or errors) or the timeout passes"""
+    result = results_dict.get(image_id)
+    if result is not None and 'event' in result:
+        result['event'].wait(timeout=STATUS_WAIT_TIMEOUT)
+    return document_status(image_id)
+
+IMAGE_CACHE_MAX_AGE = 3600  # seconds
+
 @app.route('/document-image/<image_id>')
 @login_required
 def serve_document_image(image_id):
-    """Serve document image from memory or disk"""
+    """Serve document image from disk"""
     if image_id in results_dict:
         result = results_dict[image_id]
-        
-        # Check if we have in-memory image data
-        if 'image_data' in result:
-            _, mimetype = get_file_extension(result['path'])
-            
-            # Create BytesIO object from image data
-            img_io = BytesIO(result['image_data'])
-            img_io.seek(0)
-            
-            return send_file(img_io, mimetype=mimetype)
-        
-        # If image data not in memory, get the file path
         file_path = result['path']
         
         # Check if file exists
         if os.path.exists(file_path):
-            _, mimetype = get_file_extension(file_path)
-            return send_file(file_path, mimetype=mimetype)
+            mimetype = result['mimetype']
+            
+            # Behind nginx, let it send the file itself so this thread is freed immediately
+            accel_prefix = app.config['X_ACCEL_REDIRECT_PREFIX']
+            if accel_prefix:
+                response = Response(mimetype=mimetype)
+                response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{result['basename']}"
+                response.headers['Cache-Control'] = f"private, max-age={IMAGE_CACHE_MAX_AGE}"
+                return response
+            
+            # Uploads are never rewritten under the same name, so let browsers cache and
+            # revalidate them (ETag/If-None-Match, Range) instead of refetching every view
+            response = send_file(file_path, mimetype=mimetype, conditional=True, etag=True,
+                                 max_age=IMAGE_CACHE_MAX_AGE)
+            # send_file marks the response public; these are per-user documents
+            response.cache_control.public = False
+            response.cache_control.private = True
+            return response
 
     # If image not found or file doesn't exist
     return jsonify({'error': 'Image not found'}), 404
@@ -877,40 +1151,54 @@ def save_document():
         # Store the updated data
         if 'parsed_data' in results_dict[image_id]:
             results_dict[image_id]['parsed_data'].update(corrected_data)
+            # Corrections change the export; drop the cached download payload
+            results_dict[image_id].pop('csv_download', None)
         
-        # Clean up the file if it's not already cleaned up but ensure we keep image_data
+        # Saved documents stay on disk, where the review page serves them from, for a
+        # short retention period instead of being copied into memory and deleted
         if app.config['CLEANUP_AFTER_PROCESSING'] and 'path' in results_dict[image_id]:
-            file_path = results_dict[image_id]['path']
-            # Ensure we have image data in memory before deleting the file
-            if 'image_data' not in results_dict[image_id] and os.path.exists(file_path):
-                try:
-                    # Read the image file into memory
-                    with open(file_path, 'rb') as f:
-                        image_data = f.read()
-                    results_dict[image_id]['image_data'] = image_data
-                    # Now we can delete the file
-                    delete_file(file_path)
-                except Exception as e:
-                    print(f"Error reading image data before cleanup: {str(e)}")
-            elif os.path.exists(file_path):
-                # We already have image data, just delete the file
-                delete_file(file_path)
+            schedule_file_cleanup(results_dict[image_id]['path'], delay=app.config['SAVED_FILE_RETENTION'])
         
     # Only save to Google Sheets if verified
     if verified:
-        # Save to Google Sheets
-        save_success = save_document_data(
+        # Save to Google Sheets in the background; progress is reported by /api/sheets-status
+        sheets_future = save_document_data_async(
             session.get('user_email'),
             document_type,
             corrected_data,
             corrections
         )
-        
-        if not save_success:
-            return jsonify({'success': False, 'error': 'Failed to save data to Google Sheets'}), 500
+        if image_id in results_dict:
+            results_dict[image_id]['sheets_future'] = sheets_future
+        return jsonify({'success': True, 'queued': True}), 202
             
     return jsonify({'success': True})
 
+@app.route('/api/sheets-status/<image_id>')
+@login_required
+def sheets_status(image_id):
+    """Report whether a document's Google Sheets row is still queued, written or failed"""
+    result = results_dict.get(image_id)
+    sheets_future = result.get('sheets_future') if result else None
+    if sheets_future is None:
+        return jsonify({'status': 'not_found'})
+    if not sheets_future.done():
+        return jsonify({'status': 'queued'})
+    
+    # The save resolves to the buffered row's Future, which the flusher resolves
+    # once the row's batch is written (or dropped after repeated failures)
+    written = sheets_future.result() if sheets_future.exception() is None else None
+    if written is not None and not written.done():
+        return jsonify({'status': 'queued'})
+    if written is not None and written.result():
+        return jsonify({'status': 'saved'})
+    return jsonify({'status': 'failed', 'error': 'Failed to save data to Google Sheets'})
+
+def attachment_response(body, download_name, mimetype):
+    """Send body (str or bytes) as a file download without copying it into a BytesIO first"""
+    return Response(body, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{download_name}"'})
+
 @app.route('/download_csv/<image_id>')
 @login_required
 def download_csv(image_id):
@@ -921,45 +1209,32 @@ def download_csv(image_id):
     
     result = results_dict[image_id]
     document_type = session.get('document_type', 'document')
-    filename = os.path.basename(result['path'])
+    filename = result['basename']
     
-    # Check if we have CSV content already or need to generate it
-    if 'csv_content' not in result:
-        # Generate CSV content
+    # Reuse the encoded CSV until the document type or the (corrected) data changes
+    cache_key = content_key(document_type, result.get('parsed_data', result['data']))
+    cached = result.get('csv_download')
+    if cached and cached[0] == cache_key:
+        payload = cached[1]
+    else:
+        # Build from the parsed data so saved corrections are included
         all_results = [{
             'filename': filename,
-            'extraction_data': result['data']
+            'extraction_data': result.get('parsed_data', result['data'])
         }]
-        csv_content = convert_to_csv_content(all_results, document_type)
-    else:
-        csv_content = result['csv_content']
-    
-    # Convert the TSV content to actual CSV content with commas
-    csv_lines = []
-    for line in csv_content.split('\n'):
-        if line.strip():
-            # Convert tab-separated values to comma-separated values
-            values = line.split('\t')
-            # Properly escape values containing commas by enclosing them in quotes
-            escaped_values = [f'"{value}"' if ',' in value else value for value in values]
-            csv_lines.append(','.join(escaped_values))
-    
-    csv_content = '\n'.join(csv_lines)
-    
-    # Create a memory file
-    mem_file = BytesIO()
-    mem_file.write(csv_content.encode('utf-8'))
-    mem_file.seek(0)
+        tsv_lines = iter_tsv_lines(all_results, document_type)
+        
+        # Convert the TSV lines to CSV; csv.writer handles RFC 4180 quoting of commas and quotes
+        output = StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerows(line.rstrip('\n').split('\t') for line in tsv_lines if line.strip())
+        payload = output.getvalue().encode('utf-8')
+        result['csv_download'] = (cache_key, payload)
     
     # Generate a timestamp for the filename
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     
-    return send_file(
-        mem_file,
-        as_attachment=True,
-        download_name=f"{document_type}_{filename}_{timestamp}.csv",
-        mimetype='text/csv'
-    )
+    return attachment_response(payload, f"{document_type}_{filename}_{timestamp}.csv", 'text/csv')
 
 @app.route('/download_txt/<image_id>')
 @login_required
@@ -971,7 +1246,7 @@ def download_txt(image_id):
     
     result = results_dict[image_id]
     document_type = session.get('document_type', 'document')
-    filename = os.path.basename(result['path'])
+    filename = result['basename']
     
     # Check if we have TXT content already or need to generate it
     if 'txt_content' not in result:
@@ -980,20 +1255,10 @@ def download_txt(image_id):
     else:
         txt_content = result['txt_content']
     
-    # Create a memory file
-    mem_file = BytesIO()
-    mem_file.write(txt_content.encode('utf-8'))
-    mem_file.seek(0)
-    
     # Generate a timestamp for the filename
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     
-    return send_file(
-        mem_file,
-        as_attachment=True,
-        download_name=f"{document_type}_{filename}_{timestamp}.txt",
-        mimetype='text/plain'
-    )
+    return attachment_response(txt_content, f"{document_type}_{filename}_{timestamp}.txt", 'text/plain')
 
 # Add a registration route (optional)
 @app.route('/register', methods=['POST'])
@@ -8,6 +8,28 @@ class Config:
     # Add other configuration settings as needed
     DEBUG = True
     SECRET_KEY = 'your-secret-key-here'  # Change this in production!
+    
+    # bcrypt cost factor for new password hashes, including accounts seeded at runtime.
+    # Unless BCRYPT_ROUNDS is set, user_auth calibrates it at startup to the highest cost up to
+    # 12 that hashes within BCRYPT_TARGET_MS, never going below BCRYPT_MIN_ROUNDS
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+    BCRYPT_ROUNDS_FIXED = 'BCRYPT_ROUNDS' in os.environ
+    BCRYPT_TARGET_MS = int(os.environ.get('BCRYPT_TARGET_MS', 250))
+    BCRYPT_MIN_ROUNDS = 10
+    # Cost init_db.py hashes its demo accounts with; set SEED_BCRYPT_ROUNDS=4 when seeding a
+    # throwaway dev or CI database so it doesn't spend ~250ms per user
+    SEED_BCRYPT_ROUNDS = int(os.environ.get('SEED_BCRYPT_ROUNDS', BCRYPT_ROUNDS))
+    
+    # Run on every SQLite connection to the users database. journal_mode=WAL is stored in
+    # the database file; the rest are per-connection, so the app must apply them too
+    SQLITE_PRAGMAS = """
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA mmap_size=268435456;
+        PRAGMA cache_size=-20000;
+        PRAGMA busy_timeout=5000;
+    """
 
 # Default users dictionary (used for initial setup)
 USERS = {
@@ -6,12 +6,13 @@ from config import Config
 def init_database():
     # Ensure data directory exists
     data_dir = os.path.dirname(Config.USER_DB_PATH)
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
+    os.makedirs(data_dir, exist_ok=True)
 
-    # Connect to database
+    # Connect to database; WAL lets readers proceed while a login updates last_login,
+    # and synchronous=NORMAL drops the extra fsync per commit (still crash-safe in WAL mode)
     conn = sqlite3.connect(Config.USER_DB_PATH)
     cursor = conn.cursor()
+    cursor.executescript(Config.SQLITE_PRAGMAS)
 
     # Create users table
     cursor.execute('''
@@ -30,6 +31,13 @@ def init_database():
         )
     ''')
 
+    # Covering index for username lookups, the same one UserAuth creates
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_username_cover ON users (
+            username, is_active, password_hash, role, full_name, email, annotation_mode, verification_mode
+        )
+    ''')
+
     # Create initial users
     initial_users = [
         {
@@ -48,26 +56,32 @@ def init_database():
         }
     ]
 
-    # Insert users
-    for user in initial_users:
-        # Check if user already exists
-        cursor.execute("SELECT username FROM users WHERE username = ?", (user['username'],))
-        if cursor.fetchone() is None:
-            # Hash the password
-            password_hash = bcrypt.hashpw(user['password'].encode('utf-8'), bcrypt.gensalt())
-            
-            # Insert the user
-            cursor.execute('''
-                INSERT INTO users (username, password_hash, role, full_name, email)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                user['username'],
-                password_hash,
-                user['role'],
-                user['full_name'],
-                user['email']
-            ))
-            print(f"Created user: {user['username']}")
+    # Find which users already exist with one query, so only new users pay for bcrypt
+    usernames = [user['username'] for user in initial_users]
+    placeholders = ','.join('?' * len(usernames))
+    cursor.execute(f"SELECT username FROM users WHERE username IN ({placeholders})", usernames)
+    existing = {row[0] for row in cursor.fetchall()}
+    new_users = [user for user in initial_users if user['username'] not in existing]
+
+    # Hash the passwords at the seed cost and insert all new users in one statement
+    cursor.executemany('''
+        INSERT OR IGNORE INTO users (username, password_hash, role, full_name, email)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [
+        (
+            user['username'],
+            bcrypt.hashpw(user['password'].encode('utf-8'), bcrypt.gensalt(rounds=Config.SEED_BCRYPT_ROUNDS)),
+            user['role'],
+            user['full_name'],
+            user['email']
+        )
+        for user in new_users
+    ])
+    for user in new_users:
+        print(f"Created user: {user['username']}")
+
+    # Gather planner statistics now that the table and its index are populated
+    cursor.execute("ANALYZE")
 
     # Commit changes and close connection
     conn.commit()
@@ -2,19 +2,157 @@ import sqlite3
 import bcrypt
 import logging
 import os
+import time
+import queue
+import atexit
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from config import Config
 
-# Set up logging
+# Set up logging. Records are only queued on the calling thread; a background listener
+# formats them and does the file and console writes, so logins never wait on log I/O
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [
+    logging.FileHandler("user_auth.log"),
+    logging.StreamHandler()
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+_log_queue = queue.Queue(-1)
+_log_listener = QueueListener(_log_queue, *_log_handlers)
+_log_listener.start()
+atexit.register(_log_listener.stop)  # Drains queued records before exit
+
+# The queued record keeps only the bare message; the listener's handlers add the layout
+_queue_handler = QueueHandler(_log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("user_auth.log"),
-        logging.StreamHandler()
-    ]
+    handlers=[_queue_handler]
 )
 logger = logging.getLogger(__name__)
 
+# Statements are always executed through these exact strings so sqlite3's per-connection
+# statement cache (which is keyed on the SQL text) reuses the compiled statement
+# Rows come back as plain tuples; these name their columns, in SELECT order, for building
+# the dicts callers receive (one allocation per row instead of a sqlite3.Row plus a dict copy)
+_USER_FIELDS = ('id', 'username', 'role', 'full_name', 'email', 'is_active', 'annotation_mode', 'verification_mode')
+_AUTH_FIELDS = ('id', 'username', 'password_hash', 'role', 'full_name', 'email', 'is_active', 'annotation_mode', 'verification_mode')
+_LISTED_USER_FIELDS = ('id', 'username', 'role', 'full_name', 'email', 'created_at', 'last_login', 'is_active', 'annotation_mode', 'verification_mode')
+_USER_COLUMNS = ", ".join(_USER_FIELDS)
+# Username lookups name the covering index explicitly: for an equality match on a UNIQUE
+# column SQLite always takes the column's autoindex, then fetches the table row for the rest
+_USERNAME_INDEX = "idx_users_username_cover"
+_SQL_AUTH = f"SELECT {', '.join(_AUTH_FIELDS)} FROM users INDEXED BY {_USERNAME_INDEX} WHERE username = ?"
+_SQL_GET_USER = f"SELECT {_USER_COLUMNS} FROM users INDEXED BY {_USERNAME_INDEX} WHERE username = ?"
+_SQL_GET_USER_BY_ID = f"SELECT {_USER_COLUMNS} FROM users WHERE id = ?"
+_SQL_GET_ALL_USERS = f"SELECT {', '.join(_LISTED_USER_FIELDS)} FROM users"
+_SQL_GET_PASSWORD_HASH = f"SELECT id, password_hash, is_active FROM users INDEXED BY {_USERNAME_INDEX} WHERE username = ?"
+_SQL_HAS_USERNAME_INDEX = f"SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = '{_USERNAME_INDEX}'"
+_SQL_USER_EXISTS = "SELECT id FROM users WHERE username = ?"
+_SQL_COUNT_USERS = "SELECT COUNT(*) FROM users"
+_SQL_INSERT_USER = "INSERT INTO users (username, password_hash, role, full_name, email, annotation_mode, verification_mode) VALUES (?, ?, ?, ?, ?, ?, ?)"
+_SQL_IMPORT_USER = "INSERT INTO users (username, password_hash, role, full_name) VALUES (?, ?, ?, ?)"
+_SQL_UPDATE_LAST_LOGIN = "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?"
+_SQL_UPDATE_PASSWORD = "UPDATE users SET password_hash = ? WHERE username = ?"
+_SQL_UPDATE_USER = (
+    "UPDATE users SET role = COALESCE(?, role), full_name = COALESCE(?, full_name), email = COALESCE(?, email), "
+    "is_active = COALESCE(?, is_active), annotation_mode = COALESCE(?, annotation_mode), "
+    "verification_mode = COALESCE(?, verification_mode) WHERE username = ? RETURNING id"
+)
+_SQL_SET_ACTIVE = "UPDATE users SET is_active = ? WHERE username = ? RETURNING id"
+_SQL_DELETE_USER = "DELETE FROM users WHERE username = ? RETURNING id"
+# The username lookups without the index hint, for a database the index couldn't be created in
+# (INDEXED BY fails the whole statement when the index is missing)
+_UNHINTED_SQL = {
+    sql: sql.replace(f" INDEXED BY {_USERNAME_INDEX}", "")
+    for sql in (_SQL_AUTH, _SQL_GET_USER, _SQL_GET_PASSWORD_HASH)
+}
+
+# Stored in the database's PRAGMA user_version once _init_db has created the table, run the
+# column migrations and seeded users; bump it whenever _init_db's schema steps change
+SCHEMA_VERSION = 1
+
+# Cached user lookups are capped in number and age; the age bound covers changes made
+# outside this process (e.g. init_db.py or another worker)
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 300  # seconds
+
+def _calibrate_bcrypt_rounds(target_seconds, max_rounds, min_rounds):
+    """
+    Pick the highest bcrypt cost, up to max_rounds, whose hash finishes within target_seconds
+    on this machine (never lower than min_rounds). Existing hashes keep verifying at any
+    cost, since the cost is stored in each hash
+    """
+    rounds = max_rounds
+    while rounds > min_rounds:
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds=rounds))
+        if time.perf_counter() - start <= target_seconds:
+            break
+        rounds -= 1
+    return rounds
+
+if not Config.BCRYPT_ROUNDS_FIXED:
+    Config.BCRYPT_ROUNDS = _calibrate_bcrypt_rounds(
+        Config.BCRYPT_TARGET_MS / 1000, Config.BCRYPT_ROUNDS, Config.BCRYPT_MIN_ROUNDS
+    )
+    logger.info(f"Calibrated bcrypt cost to {Config.BCRYPT_ROUNDS} rounds")
+
+def _hash_seed_password(password):
+    """bcrypt hash for a seeded demo account, at the same cost as every other account"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=Config.BCRYPT_ROUNDS))
+
+class _ConnectionPool:
+    """
+    Long-lived connections to the users database: up to max_readers read-only connections,
+    reused most-recent-first, and one write connection shared by writers under a lock.
+    In WAL mode the readers never wait on the writer
+    """
+    
+    def __init__(self, db_path, max_readers=8):
+        self.db_path = db_path
+        self._readers = queue.LifoQueue()
+        self._reader_slots = threading.BoundedSemaphore(max_readers)
+        self._writer = None
+        # Re-entrant so a write block can call a helper that also writes
+        self._write_lock = threading.RLock()
+    
+    def _open(self, query_only=False):
+        """Open a connection; connections stay open so their compiled statement cache survives"""
+        # Autocommit: every statement is its own transaction, so a failed call can
+        # never leave a pooled connection holding an open write transaction
+        conn = sqlite3.connect(self.db_path, isolation_level=None, cached_statements=128, check_same_thread=False)
+        # WAL, synchronous=NORMAL and cache settings; most are per-connection, so each one applies them
+        conn.executescript(Config.SQLITE_PRAGMAS)
+        if query_only:
+            conn.execute("PRAGMA query_only=1")
+        return conn
+    
+    @contextmanager
+    def read(self):
+        """Borrow a read-only connection"""
+        with self._reader_slots:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                conn = self._open(query_only=True)
+            try:
+                yield conn
+            finally:
+                self._readers.put(conn)
+    
+    @contextmanager
+    def write(self):
+        """Hold the write connection"""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self._open()
+            yield self._writer
+
 class UserAuth:
     """
     User authentication class that handles user registration, login, and password management
@@ -29,6 +167,18 @@ class UserAuth:
             db_path: Path to the SQLite database file
         """
         self.db_path = db_path or Config.USER_DB_PATH
+        self._pool = _ConnectionPool(self.db_path)
+        # get_user/get_user_by_id results keyed by ('username', name) and ('id', id); LRU ordered
+        self._user_cache = OrderedDict()
+        self._user_cache_lock = threading.Lock()
+        # Bumped per cache key on every invalidation, so a read that raced a write isn't cached
+        self._user_generations = {}
+        # Single thread for writes nobody waits on (last-login stamps)
+        self._background_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='userdb')
+        # Checked against when a username doesn't exist, so unknown users cost as much as wrong passwords
+        self._dummy_hash = bcrypt.hashpw(b"dummy-password", bcrypt.gensalt(rounds=Config.BCRYPT_ROUNDS))
+        # Set by _init_db once the covering username index is known to exist
+        self._has_username_index = False
         self._init_db()
     
     def _init_db(self):
@@ -38,47 +188,71 @@ class UserAuth:
         try:
             # Create the database directory if it doesn't exist
             db_dir = os.path.dirname(self.db_path)
-            if db_dir and not os.path.exists(db_dir):
+            if db_dir:
                 os.makedirs(db_dir, exist_ok=True)
             
             # Connect to the database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Create the users table if it doesn't exist
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    full_name TEXT,
-                    email TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_login TIMESTAMP,
-                    is_active INTEGER DEFAULT 1,
-                    annotation_mode TEXT DEFAULT 'manual',
-                    verification_mode INTEGER DEFAULT 0
-                )
-            ''')
-            
-            # Check if the annotation_mode column exists, add it if it doesn't
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            if 'annotation_mode' not in columns:
-                logger.info("Adding annotation_mode column to users table")
-                cursor.execute("ALTER TABLE users ADD COLUMN annotation_mode TEXT DEFAULT 'manual'")
+            with self._pool.write() as conn:
+                cursor = conn.cursor()
                 
-            if 'verification_mode' not in columns:
-                logger.info("Adding verification_mode column to users table")
-                cursor.execute("ALTER TABLE users ADD COLUMN verification_mode INTEGER DEFAULT 0")
-            
-            # Commit the changes and close the connection
-            conn.commit()
-            conn.close()
-            
-            # Import existing users from config.py if the table is empty
-            self._import_existing_users()
+                # A database already stamped with the current schema version needs no setup,
+                # as long as the covering index the username lookups name is still there
+                cursor.execute("PRAGMA user_version")
+                schema_version = cursor.fetchone()[0]
+                cursor.execute(_SQL_HAS_USERNAME_INDEX)
+                self._has_username_index = cursor.fetchone() is not None
+                if schema_version >= SCHEMA_VERSION and self._has_username_index:
+                    logger.info("Database schema is up to date")
+                    return
+                
+                # Create the users table if it doesn't exist
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS users (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        username TEXT UNIQUE NOT NULL,
+                        password_hash TEXT NOT NULL,
+                        role TEXT NOT NULL DEFAULT 'annotator',
+                        full_name TEXT,
+                        email TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        last_login TIMESTAMP,
+                        is_active INTEGER DEFAULT 1,
+                        annotation_mode TEXT DEFAULT 'manual',
+                        verification_mode INTEGER DEFAULT 0
+                    )
+                ''')
+                
+                # Check if the annotation_mode column exists, add it if it doesn't
+                cursor.execute("PRAGMA table_info(users)")
+                columns = [column[1] for column in cursor.fetchall()]
+                
+                if 'role' not in columns:
+                    logger.info("Adding role column to users table")
+                    cursor.execute("ALTER TABLE users ADD COLUMN role TEXT NOT NULL DEFAULT 'annotator'")
+                
+                if 'annotation_mode' not in columns:
+                    logger.info("Adding annotation_mode column to users table")
+                    cursor.execute("ALTER TABLE users ADD COLUMN annotation_mode TEXT DEFAULT 'manual'")
+                    
+                if 'verification_mode' not in columns:
+                    logger.info("Adding verification_mode column to users table")
+                    cursor.execute("ALTER TABLE users ADD COLUMN verification_mode INTEGER DEFAULT 0")
+                
+                # Covering index for username lookups, so logins and get_user are served from index pages
+                # (uniqueness is still enforced by the username column's own constraint)
+                cursor.execute(f'''
+                    CREATE INDEX IF NOT EXISTS {_USERNAME_INDEX} ON users (
+                        username, is_active, password_hash, role, full_name, email, annotation_mode, verification_mode
+                    )
+                ''')
+                self._has_username_index = True
+                
+                # Import existing users from config.py if the table is empty (on this same connection);
+                # once that has succeeded, gather planner statistics and stamp the version so later
+                # starts take the fast path (and ANALYZE runs only once)
+                if self._import_existing_users():
+                    cursor.execute("ANALYZE")
+                    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
             
             logger.info("Database initialized successfully")
         except Exception as e:
@@ -87,53 +261,53 @@ class UserAuth:
     def _import_existing_users(self):
         """
         Import existing users from config.py if the table is empty
+        
+        Returns:
+            bool: False if the import failed, True otherwise
         """
         try:
             # Connect to the database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Check if the users table is empty
-            cursor.execute("SELECT COUNT(*) FROM users")
-            count = cursor.fetchone()[0]
-            
-            if count == 0:
-                logger.info("Importing existing users from config.py")
+            with self._pool.write() as conn:
+                cursor = conn.cursor()
                 
-                # Import existing users from config.py
-                try:
-                    from config import USERS
-                    for username, user_data in USERS.items():
-                        try:
-                            # Hash the password
-                            password_hash = bcrypt.hashpw(user_data['password'].encode('utf-8'), bcrypt.gensalt())
-                            
-                            # Insert the user into the database
-                            cursor.execute(
-                                "INSERT INTO users (username, password_hash, role, full_name) VALUES (?, ?, ?, ?)",
-                                (username, password_hash, user_data['role'], user_data.get('full_name', ''))
-                            )
-                        except Exception as e:
-                            logger.error(f"Error importing user {username}: {str(e)}")
+                # Check if the users table is empty
+                cursor.execute(_SQL_COUNT_USERS)
+                count = cursor.fetchone()[0]
                 
-                    # Commit the changes
-                    conn.commit()
-                    logger.info(f"Imported default users")
-                except ImportError:
-                    # Create default admin user if USERS is not available
-                    logger.info("Creating default admin user")
-                    admin_password = bcrypt.hashpw('admin123'.encode('utf-8'), bcrypt.gensalt())
-                    cursor.execute(
-                        "INSERT INTO users (username, password_hash, role, full_name) VALUES (?, ?, ?, ?)",
-                        ('admin@example.com', admin_password, 'admin', 'Admin User')
-                    )
-                    conn.commit()
-                    logger.info("Created default admin user")
-            
-            # Close the connection
-            conn.close()
+                if count == 0:
+                    logger.info("Importing existing users from config.py")
+                    
+                    # Import existing users from config.py
+                    try:
+                        from config import USERS
+                        
+                        # Hash every password up front; bcrypt releases the GIL, so the hashes
+                        # run in parallel across cores. Then insert all users in a single transaction
+                        workers = max(1, min(len(USERS), os.cpu_count() or 1))
+                        with ThreadPoolExecutor(max_workers=workers) as pool:
+                            password_hashes = list(pool.map(_hash_seed_password, (user_data['password'] for user_data in USERS.values())))
+                        rows = [
+                            (username, password_hash, user_data['role'], user_data.get('full_name', ''))
+                            for (username, user_data), password_hash in zip(USERS.items(), password_hashes)
+                        ]
+                        cursor.execute("BEGIN")
+                        with conn:
+                            cursor.executemany(_SQL_IMPORT_USER, rows)
+                    
+                        logger.info(f"Imported default users")
+                    except ImportError:
+                        # Create default admin user if USERS is not available
+                        logger.info("Creating default admin user")
+                        admin_password = _hash_seed_password('admin123')
+                        cursor.execute(
+                            _SQL_IMPORT_USER,
+                            ('admin@example.com', admin_password, 'admin', 'Admin User')
+                        )
+                        logger.info("Created default admin user")
+            return True
         except Exception as e:
             logger.error(f"Error importing existing users: {str(e)}")
+            return False
     
     def register_user(self, username, password, role='annotator', full_name='', email='', annotation_mode='manual', verification_mode=False):
         """
@@ -151,28 +325,23 @@ class UserAuth:
             tuple: (success, message)
         """
         try:
-            # Connect to the database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             # Check if the username already exists
-            cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
-            if cursor.fetchone():
-                conn.close()
-                return False, "Username already exists"
-            
-            # Hash the password
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-            
-            # Insert the new user
-            cursor.execute(
-                "INSERT INTO users (username, password_hash, role, full_name, email, annotation_mode, verification_mode) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (username, password_hash, role, full_name, email, annotation_mode, 1 if verification_mode else 0)
-            )
-            
-            # Commit the changes and close the connection
-            conn.commit()
-            conn.close()
+            with self._pool.read() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_SQL_USER_EXISTS, (username,))
+                if cursor.fetchone():
+                    return False, "Username already exists"
+            
+            # Hash the password without holding a connection
+            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=Config.BCRYPT_ROUNDS))
+            
+            # Insert the new user (a concurrent registration of the same name fails on the UNIQUE constraint)
+            with self._pool.write() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    _SQL_INSERT_USER,
+                    (username, password_hash, role, full_name, email, annotation_mode, int(bool(verification_mode)))
+                )
             
             logger.info(f"User {username} registered successfully")
             return True, "User registered successfully"
@@ -192,53 +361,53 @@ class UserAuth:
             tuple: (success, user_data or error_message)
         """
         try:
-            # Connect to the database
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row  # Return rows as dictionaries
-            cursor = conn.cursor()
-            
-            # Get the user from the database
-            cursor.execute(
-                "SELECT id, username, password_hash, role, full_name, email, is_active, annotation_mode, verification_mode FROM users WHERE username = ?",
-                (username,)
-            )
-            user = cursor.fetchone()
+            # Get the user from the database; the connection goes back to the pool before bcrypt runs
+            with self._pool.read() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    self._username_sql(_SQL_AUTH),
+                    (username,)
+                )
+                row = cursor.fetchone()
+            user = dict(zip(_AUTH_FIELDS, row)) if row else None
             
-            # Check if the user exists
+            # Check if the user exists; still pay for one bcrypt check so the response
+            # time doesn't reveal which usernames are registered
             if not user:
-                conn.close()
+                bcrypt.checkpw(password.encode('utf-8'), self._dummy_hash)
                 return False, "Invalid username or password"
             
             # Check if the user is active
             if not user['is_active']:
-                conn.close()
                 return False, "User account is inactive"
             
             # Check if the password is correct
             if bcrypt.checkpw(password.encode('utf-8'), user['password_hash']):
-                # Update last login timestamp
-                cursor.execute(
-                    "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?",
-                    (user['id'],)
-                )
-                conn.commit()
-                
-                # Convert user row to dictionary
-                user_dict = dict(user)
-                
-                # Close the connection
-                conn.close()
+                # Update last login timestamp off the request thread, so a login never waits on the write lock
+                self._background_writer.submit(self._update_last_login, user['id'])
                 
                 logger.info(f"User {username} authenticated successfully")
-                return True, user_dict
+                return True, user
             else:
-                conn.close()
                 logger.warning(f"Failed authentication attempt for user {username}")
                 return False, "Invalid username or password"
         except Exception as e:
             logger.error(f"Error authenticating user {username}: {str(e)}")
             return False, f"Error authenticating user: {str(e)}"
     
+    def _update_last_login(self, user_id):
+        """
+        Stamp a user's last login time; runs on the background writer thread
+        
+        Args:
+            user_id: ID of the user who logged in
+        """
+        try:
+            with self._pool.write() as conn:
+                conn.execute(_SQL_UPDATE_LAST_LOGIN, (user_id,))
+        except Exception as e:
+            logger.error(f"Error updating last login for user ID {user_id}: {str(e)}")
+    
     def change_password(self, username, current_password, new_password):
         """
         Change a user's password
@@ -252,35 +421,125 @@ class UserAuth:
             tuple: (success, message)
         """
         try:
-            # First authenticate the user with the current password
-            success, result = self.authenticate_user(username, current_password)
+            # Verify the current password against the stored hash (one bcrypt check, no login side effects)
+            with self._pool.read() as conn:
+                cursor = conn.cursor()
+                cursor.execute(self._username_sql(_SQL_GET_PASSWORD_HASH), (username,))
+                row = cursor.fetchone()
+            user_id, password_hash, is_active = row if row else (None, self._dummy_hash, 0)
             
-            if not success:
-                return False, "Current password is incorrect"
+            password_ok = bcrypt.checkpw(current_password.encode('utf-8'), password_hash)
             
-            # Connect to the database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            if not row or not password_ok or not is_active:
+                return False, "Current password is incorrect"
             
             # Hash the new password
-            new_password_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+            new_password_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt(rounds=Config.BCRYPT_ROUNDS))
             
             # Update the password
-            cursor.execute(
-                "UPDATE users SET password_hash = ? WHERE username = ?",
-                (new_password_hash, username)
-            )
-            
-            # Commit the changes and close the connection
-            conn.commit()
-            conn.close()
+            with self._pool.write() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    _SQL_UPDATE_PASSWORD,
+                    (new_password_hash, username)
+                )
             
+            self._invalidate_user(username, user_id)
             logger.info(f"Password changed successfully for user {username}")
             return True, "Password changed successfully"
         except Exception as e:
             logger.error(f"Error changing password for user {username}: {str(e)}")
             return False, f"Error changing password: {str(e)}"
     
+    def _username_sql(self, sql):
+        """
+        Return a username lookup statement, without its index hint if the index is missing
+        
+        Args:
+            sql: One of the _SQL_* username lookups
+            
+        Returns:
+            str: The statement to execute
+        """
+        return sql if self._has_username_index else _UNHINTED_SQL[sql]
+    
+    def _cached_user(self, kind, key):
+        """
+        Look up a cached get_user/get_user_by_id result
+        
+        Args:
+            kind: 'username' or 'id'
+            key: Username or user ID
+            
+        Returns:
+            dict: A copy of the cached user data, or None on a miss or expired entry
+        """
+        with self._user_cache_lock:
+            entry = self._user_cache.get((kind, key))
+            if entry is None:
+                return None
+            stored_at, user = entry
+            if time.monotonic() - stored_at > USER_CACHE_TTL:
+                self._user_cache.pop(('username', user['username']), None)
+                self._user_cache.pop(('id', user['id']), None)
+                return None
+            self._user_cache.move_to_end((kind, key))
+            return dict(user)
+    
+    def _user_generation(self, kind, key):
+        """
+        Current invalidation generation of a cache key, taken before reading the database
+        
+        Args:
+            kind: 'username' or 'id'
+            key: Username or user ID
+            
+        Returns:
+            int: Number of times the key has been invalidated
+        """
+        with self._user_cache_lock:
+            return self._user_generations.get((kind, key), 0)
+    
+    def _cache_user(self, user, kind, key, generation):
+        """
+        Cache user data under both its username and its ID, unless the user changed
+        since the data was read
+        
+        Args:
+            user: User data as returned by get_user
+            kind: 'username' or 'id', the key the data was looked up by
+            key: Username or user ID the data was looked up by
+            generation: Result of _user_generation(kind, key) taken before the read
+            
+        Returns:
+            dict: A copy of the user data for the caller
+        """
+        entry = (time.monotonic(), user)
+        with self._user_cache_lock:
+            # Invalidation bumps both keys, so checking the one we read by is enough
+            if self._user_generations.get((kind, key), 0) != generation:
+                return dict(user)
+            self._user_cache[('username', user['username'])] = entry
+            self._user_cache[('id', user['id'])] = entry
+            self._user_cache.move_to_end(('username', user['username']))
+            self._user_cache.move_to_end(('id', user['id']))
+            while len(self._user_cache) > USER_CACHE_SIZE:
+                self._user_cache.popitem(last=False)
+        return dict(user)
+    
+    def _invalidate_user(self, username, user_id):
+        """
+        Drop a user's cached data after it changed, under both of its keys
+        
+        Args:
+            username: Username of the changed user
+            user_id: ID of the changed user
+        """
+        with self._user_cache_lock:
+            for key in (('username', username), ('id', user_id)):
+                self._user_cache.pop(key, None)
+                self._user_generations[key] = self._user_generations.get(key, 0) + 1
+    
     def get_user(self, username):
         """
         Get a user by username
@@ -292,23 +551,25 @@ class UserAuth:
             dict: User data or None if not found
         """
         try:
-            # Connect to the database
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row  # Return rows as dictionaries
-            cursor = conn.cursor()
-            
-            # Get the user from the database
-            cursor.execute(
-                "SELECT id, username, role, full_name, email, is_active, annotation_mode, verification_mode FROM users WHERE username = ?",
-                (username,)
-            )
-            user = cursor.fetchone()
-            
-            # Close the connection
-            conn.close()
+            # Most requests look up the session's user; serve repeats from the cache
+            user = self._cached_user('username', username)
+            if user is not None:
+                return user
+            generation = self._user_generation('username', username)
             
+            # Connect to the database
+            with self._pool.read() as conn:
+                cursor = conn.cursor()
+                
+                # Get the user from the database
+                cursor.execute(
+                    self._username_sql(_SQL_GET_USER),
+                    (username,)
+                )
+                user = cursor.fetchone()
+                
             if user:
-                return dict(user)
+                return self._cache_user(dict(zip(_USER_FIELDS, user)), 'username', username, generation)
             else:
                 return None
         except Exception as e:
@@ -326,29 +587,55 @@ class UserAuth:
             dict: User data or None if not found
         """
         try:
-            # Connect to the database
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row  # Return rows as dictionaries
-            cursor = conn.cursor()
-            
-            # Get the user from the database
-            cursor.execute(
-                "SELECT id, username, role, full_name, email, is_active, annotation_mode, verification_mode FROM users WHERE id = ?",
-                (user_id,)
-            )
-            user = cursor.fetchone()
-            
-            # Close the connection
-            conn.close()
+            user = self._cached_user('id', user_id)
+            if user is not None:
+                return user
+            generation = self._user_generation('id', user_id)
             
+            # Connect to the database
+            with self._pool.read() as conn:
+                cursor = conn.cursor()
+                
+                # Get the user from the database
+                cursor.execute(
+                    _SQL_GET_USER_BY_ID,
+                    (user_id,)
+                )
+                user = cursor.fetchone()
+                
             if user:
-                return dict(user)
+                return self._cache_user(dict(zip(_USER_FIELDS, user)), 'id', user_id, generation)
             else:
                 return None
         except Exception as e:
             logger.error(f"Error getting user by ID {user_id}: {str(e)}")
             return None
     
+    def iter_users(self, batch_size=256):
+        """
+        Iterate over all users without loading the whole table at once
+        
+        Args:
+            batch_size: Number of rows fetched from SQLite per round trip
+            
+        Yields:
+            dict: User data, one user at a time
+        """
+        # Connect to the database; the connection is returned to the pool once iteration ends
+        with self._pool.read() as conn:
+            cursor = conn.cursor()
+            cursor.arraysize = batch_size
+            
+            # Get all users from the database
+            cursor.execute(_SQL_GET_ALL_USERS)
+            while True:
+                rows = cursor.fetchmany()
+                if not rows:
+                    break
+                
+                # Convert rows to dictionaries
+                yield from (dict(zip(_LISTED_USER_FIELDS, row)) for row in rows)
+    
     def get_all_users(self):
         """
         Get all users
@@ -357,22 +644,7 @@ class UserAuth:
             list: List of user dictionaries
         """
         try:
-            # Connect to the database
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row  # Return rows as dictionaries
-            cursor = conn.cursor()
-            
-            # Get all users from the database
-            cursor.execute(
-                "SELECT id, username, role, full_name, email, created_at, last_login, is_active, annotation_mode, verification_mode FROM users"
-            )
-            users = cursor.fetchall()
-            
-            # Close the connection
-            conn.close()
-            
-            # Convert rows to dictionaries
-            return [dict(user) for user in users]
+            return list(self.iter_users())
         except Exception as e:
             logger.error(f"Error getting all users: {str(e)}")
             return []
@@ -394,61 +666,32 @@ class UserAuth:
             tuple: (success, message)
         """
         try:
-            # Connect to the database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Check if the user exists
-            cursor.execute("SELECT username FROM users WHERE username = ?", (username,))
-            if not cursor.fetchone():
-                conn.close()
-                return False, "User does not exist"
-            
-            # Build the update query
-            update_fields = []
-            params = []
-            
-            if role is not None:
-                update_fields.append("role = ?")
-                params.append(role)
-            
-            if full_name is not None:
-                update_fields.append("full_name = ?")
-                params.append(full_name)
-            
-            if email is not None:
-                update_fields.append("email = ?")
-                params.append(email)
-            
-            if is_active is not None:
-                update_fields.append("is_active = ?")
-                params.append(1 if is_active else 0)
-                
-            if annotation_mode is not None:
-                update_fields.append("annotation_mode = ?")
-                params.append(annotation_mode)
-                
-            if verification_mode is not None:
-                update_fields.append("verification_mode = ?")
-                params.append(1 if verification_mode else 0)
-            
-            if not update_fields:
-                conn.close()
+            if all(value is None for value in (role, full_name, email, is_active, annotation_mode, verification_mode)):
                 return False, "No fields to update"
             
-            # Add the username to the parameters
-            params.append(username)
-            
-            # Execute the update query
-            cursor.execute(
-                f"UPDATE users SET {', '.join(update_fields)} WHERE username = ?",
-                params
+            # One fixed statement for every combination of fields: None leaves a column as it is
+            params = (
+                role,
+                full_name,
+                email,
+                None if is_active is None else int(bool(is_active)),
+                annotation_mode,
+                None if verification_mode is None else int(bool(verification_mode)),
+                username
             )
             
-            # Commit the changes and close the connection
-            conn.commit()
-            conn.close()
+            # Connect to the database
+            with self._pool.write() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_SQL_UPDATE_USER, params)
+                
+                # RETURNING hands back the ID for cache invalidation; no row means the user
+                # doesn't exist (fetchall runs the statement to completion so it commits)
+                rows = cursor.fetchall()
+                if not rows:
+                    return False, "User does not exist"
             
+            self._invalidate_user(username, rows[0][0])
             logger.info(f"User {username} updated successfully")
             return True, "User updated successfully"
         except Exception as e:
@@ -467,26 +710,19 @@ class UserAuth:
         """
         try:
             # Connect to the database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Check if the user exists
-            cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-            user = cursor.fetchone()
-            
-            if not user:
-                conn.close()
-                return False, "User not found"
-            
-            # Delete the user
-            cursor.execute("DELETE FROM users WHERE username = ?", (username,))
-            
-            # Commit the changes and close the connection
-            conn.commit()
-            conn.close()
-            
-            logger.info(f"User {username} deleted successfully")
-            return True, "User deleted successfully"
+            with self._pool.write() as conn:
+                cursor = conn.cursor()
+                
+                # Delete the user; no row returned means the user doesn't exist
+                cursor.execute(_SQL_DELETE_USER, (username,))
+                rows = cursor.fetchall()
+                
+                if not rows:
+                    return False, "User not found"
+                
+                self._invalidate_user(username, rows[0][0])
+                logger.info(f"User {username} deleted successfully")
+                return True, "User deleted successfully"
         except Exception as e:
             logger.error(f"Error deleting user {username}: {str(e)}")
             return False, f"Error deleting user: {str(e)}"
@@ -503,27 +739,20 @@ class UserAuth:
         """
         try:
             # Connect to the database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Check if the user exists
-            cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-            user = cursor.fetchone()
-            
-            if not user:
-                conn.close()
-                logger.warning(f"Failed to suspend user {username}: User not found")
-                return False
-            
-            # Suspend the user by setting is_active to 0
-            cursor.execute("UPDATE users SET is_active = 0 WHERE username = ?", (username,))
-            
-            # Commit the changes and close the connection
-            conn.commit()
-            conn.close()
-            
-            logger.info(f"User {username} suspended successfully")
-            return True
+            with self._pool.write() as conn:
+                cursor = conn.cursor()
+                
+                # Suspend the user by setting is_active to 0; no row returned means the user doesn't exist
+                cursor.execute(_SQL_SET_ACTIVE, (0, username))
+                rows = cursor.fetchall()
+                
+                if not rows:
+                    logger.warning(f"Failed to suspend user {username}: User not found")
+                    return False
+                
+                self._invalidate_user(username, rows[0][0])
+                logger.info(f"User {username} suspended successfully")
+                return True
         except Exception as e:
             logger.error(f"Error suspending user {username}: {str(e)}")
             return False
@@ -540,27 +769,20 @@ class UserAuth:
         """
         try:
             # Connect to the database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Check if the user exists
-            cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
-            user = cursor.fetchone()
-            
-            if not user:
-                conn.close()
-                logger.warning(f"Failed to unsuspend user {username}: User not found")
-                return False
-            
-            # Unsuspend the user by setting is_active to 1
-            cursor.execute("UPDATE users SET is_active = 1 WHERE username = ?", (username,))
-            
-            # Commit the changes and close the connection
-            conn.commit()
-            conn.close()
-            
-            logger.info(f"User {username} unsuspended successfully")
-            return True
+            with self._pool.write() as conn:
+                cursor = conn.cursor()
+                
+                # Unsuspend the user by setting is_active to 1; no row returned means the user doesn't exist
+                cursor.execute(_SQL_SET_ACTIVE, (1, username))
+                rows = cursor.fetchall()
+                
+                if not rows:
+                    logger.warning(f"Failed to unsuspend user {username}: User not found")
+                    return False
+                
+                self._invalidate_user(username, rows[0][0])
+                logger.info(f"User {username} unsuspended successfully")
+                return True
         except Exception as e:
             logger.error(f"Error unsuspending user {username}: {str(e)}")
             return False